@@ -0,0 +1,126 @@
+import os
+import asyncio
+import threading
+import weakref
+
+from metrics import timed
+
+# Upper bound for Gemini requests in flight across all chats
+GEMINI_CONCURRENCY = int(os.getenv('GEMINI_CONCURRENCY', 8))
+
+_semaphore = asyncio.Semaphore(GEMINI_CONCURRENCY)
+
+_genai = None
+_genai_lock = threading.Lock()
+
+def get_genai():
+    """
+    Imports and configures the Gemini SDK on first use. The import alone takes
+    most of the bot's startup time, so it is kept off the startup path.
+    """
+    global _genai
+    with _genai_lock:
+        if _genai is None:
+            import google.generativeai as genai
+            api_key = os.getenv('GOOGLE_API_KEY')
+            if api_key:
+                genai.configure(api_key=api_key)
+            else:
+                print("Warning: GOOGLE_API_KEY not found in .env")
+            _genai = genai
+    return _genai
+
+async def load_genai():
+    """Like get_genai(), but runs the first import in a worker thread."""
+    if _genai is None:
+        await asyncio.to_thread(get_genai)
+    return _genai
+
+# (model name, system instruction) -> GenerativeModel, built once and reused
+_models = {}
+
+def get_model(name, system_instruction=None):
+    """
+    Returns the shared GenerativeModel for a name and system instruction.
+    Static instructions belong in `system_instruction`, so every call site
+    reuses one configured model instead of rebuilding it per request.
+    """
+    key = (name, system_instruction)
+    model = _models.get(key)
+    if model is None:
+        genai = get_genai()
+        if system_instruction:
+            model = genai.GenerativeModel(name, system_instruction=system_instruction)
+        else:
+            model = genai.GenerativeModel(name)
+        model = _models.setdefault(key, model)
+    return model
+
+# chat_id -> asyncio.Lock; entries vanish once no handler holds or waits for the lock
+_chat_locks = weakref.WeakValueDictionary()
+
+def chat_lock(chat_id):
+    """Returns the lock that keeps one chat's AI turns in order."""
+    lock = _chat_locks.get(chat_id)
+    if lock is None:
+        lock = asyncio.Lock()
+        _chat_locks[chat_id] = lock
+    return lock
+
+async def send_chat_message(chat, text):
+    """Sends a message in a Gemini ChatSession without blocking the event loop."""
+    async with _semaphore, timed("gemini", "chat"):
+        return await chat.send_message_async(text)
+
+# Marks the end of a stream in the chunk queue
+_STREAM_END = object()
+
+async def stream_chat_message(chat, text):
+    """
+    Yields the growing reply of a ChatSession while Gemini generates it. The
+    stream is read by its own task, so the Gemini slot and the latency metric
+    do not include the time the caller spends sending to Telegram.
+    """
+    chunks = asyncio.Queue()
+
+    async def read():
+        try:
+            async with _semaphore, timed("gemini", "chat_stream"):
+                response = await chat.send_message_async(text, stream=True)
+                async for chunk in response:
+                    chunks.put_nowait(chunk.text)
+            chunks.put_nowait(_STREAM_END)
+        except Exception as e:
+            chunks.put_nowait(e)
+
+    reader = asyncio.ensure_future(read())
+    try:
+        reply = ""
+        while True:
+            items = [await chunks.get()]
+            # Chunks that arrived while the caller was busy are passed on together
+            while not chunks.empty():
+                items.append(chunks.get_nowait())
+            ended = grew = False
+            error = None
+            for item in items:
+                if item is _STREAM_END:
+                    ended = True
+                elif isinstance(item, Exception):
+                    error = item
+                else:
+                    reply += item
+                    grew = True
+            if grew:
+                yield reply
+            if error:
+                raise error
+            if ended:
+                return
+    finally:
+        reader.cancel()
+
+async def generate_content(model, prompt):
+    """Runs a single Gemini generation without blocking the event loop."""
+    async with _semaphore, timed("gemini", "generate"):
+        return await model.generate_content_async(prompt)
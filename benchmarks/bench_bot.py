@@ -0,0 +1,222 @@
+"""
+End-to-end load benchmark against local fakes of Open-Meteo, CalDAV, Gemini
+and the Telegram Bot API (see fakes.py). Needs no credentials or network.
+
+Drives the daily briefing, AI chat replies and the morning broadcast through
+the bot's real code paths and reports throughput and p50/p99 latency. The
+fakes share the process with the bot, so absolute numbers are conservative;
+compare runs on the same machine.
+
+Usage: python benchmarks/bench_bot.py [--chats 1000] [--events 200] [--json]
+       python benchmarks/bench_bot.py --help
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import types
+import logging
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fakes import FakeOpenMeteo, FakeCalDAV, FakeTelegram, FakeGeminiChat, FakeGeminiModel
+
+BENCH_TOKEN = "123456:BENCHMARK"
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def summarize(name, latencies, elapsed, count=None):
+    count = len(latencies) if count is None else count
+    return {
+        "scenario": name,
+        "count": count,
+        "throughput_per_s": round(count / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+async def timed_call(coro):
+    started = time.perf_counter()
+    await coro
+    return time.perf_counter() - started
+
+
+async def bench_briefing(main, caldav, args):
+    """Cold first build, rebuilds after calendar changes and cached reads."""
+    results = []
+    account = main.briefing_account()
+
+    first = await timed_call(main.get_daily_briefing())
+    results.append(summarize("briefing_first_build", [first], first))
+
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(args.iterations):
+        caldav.touch(args.changes)
+        main.briefing_cache.invalidate(account)
+        main.weather_provider._cache.clear()
+        latencies.append(await timed_call(main.get_daily_briefing()))
+    results.append(summarize("briefing_rebuild", latencies, time.perf_counter() - started))
+
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(args.iterations * 10):
+        latencies.append(await timed_call(main.get_daily_briefing()))
+    results.append(summarize("briefing_cached", latencies, time.perf_counter() - started))
+    return results
+
+
+def text_update(update_id, chat_id, text):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Bench"},
+            "text": text,
+        },
+    }
+
+
+async def bench_ai(main, application, args):
+    """AI messages from many chats, processed concurrently like with concurrent_updates."""
+    from telegram import Update
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def one(i):
+        update = Update.de_json(text_update(i, 1000 + i % args.ai_chats, f"Frage {i}"), application.bot)
+        async with semaphore:
+            return await timed_call(application.process_update(update))
+
+    started = time.perf_counter()
+    latencies = await asyncio.gather(*(one(i) for i in range(args.ai_messages)))
+    return [summarize("ai_message", latencies, time.perf_counter() - started)]
+
+
+async def bench_broadcast(main, application, args):
+    """The morning briefing to all subscribers of one delivery slot."""
+    chat_ids = list(range(100000, 100000 + args.chats))
+    # Every tenth chat has its own location, spread over a few grid cells
+    for chat_id in chat_ids[::10]:
+        main.chat_locations.set(chat_id, 47 + chat_id % 7, 8 + chat_id % 5)
+
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(args.rounds):
+        latencies.append(await timed_call(main.morning_broadcast.deliver(application.bot, chat_ids)))
+    elapsed = time.perf_counter() - started
+    result = summarize("broadcast_round", latencies, elapsed, count=args.rounds)
+    result["messages_per_s"] = round(args.chats * args.rounds / elapsed, 1)
+    return [result]
+
+
+async def run(args):
+    openmeteo = FakeOpenMeteo(latency=args.weather_latency)
+    caldav = FakeCalDAV(calendars=args.calendars, events=args.events, latency=args.caldav_latency)
+    telegram = FakeTelegram(latency=args.telegram_latency)
+    for server in (openmeteo, caldav, telegram):
+        await server.start()
+
+    # The bot reads its configuration at import time
+    workdir = tempfile.mkdtemp(prefix="bot-bench-")
+    os.environ.update({
+        "OPEN_METEO_URL": openmeteo.url,
+        "ICLOUD_CALDAV_URL": caldav.url,
+        "ICLOUD_EMAIL": "bench@example.com",
+        "ICLOUD_PASSWORD": "bench",
+        "BOT_DB_PATH": os.path.join(workdir, "bench.sqlite3"),
+        "TELEGRAM_GLOBAL_RATE": str(args.telegram_rate),
+        "TELEGRAM_CHAT_RATE": str(args.telegram_rate),
+        "GEMINI_STREAMING": "1" if args.streaming else "0",
+        "STREAM_EDIT_INTERVAL": "0.2",
+    })
+    import main
+    import ai_utils
+    from chat_store import ChatSessionStore, ChatHistoryDB
+
+    # Per-request INFO logs would dominate the measurements
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+
+    application = main.create_application(BENCH_TOKEN, base_url=f"{telegram.url}/bot")
+
+    # Gemini is a Python SDK, so it is replaced in-process rather than over HTTP
+    main.chat_sessions = ChatSessionStore(
+        lambda history: FakeGeminiChat(args.gemini_latency, history), ChatHistoryDB()
+    )
+    ai_utils._genai = types.SimpleNamespace(
+        GenerativeModel=lambda name, **kwargs: FakeGeminiModel(args.gemini_latency)
+    )
+
+    results = []
+    async with application:
+        if "briefing" in args.scenarios:
+            results += await bench_briefing(main, caldav, args)
+        if "ai" in args.scenarios:
+            results += await bench_ai(main, application, args)
+        if "broadcast" in args.scenarios:
+            results += await bench_broadcast(main, application, args)
+
+    await main.weather_provider.aclose()
+    for server in (openmeteo, caldav, telegram):
+        await server.stop()
+
+    for result in results:
+        result["upstream_requests"] = {
+            "open_meteo": openmeteo.requests, "caldav": caldav.requests, "telegram": telegram.requests,
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default="briefing,ai,broadcast",
+                        help="comma-separated subset of briefing,ai,broadcast")
+    parser.add_argument("--calendars", type=int, default=5)
+    parser.add_argument("--events", type=int, default=200, help="events per calendar")
+    parser.add_argument("--changes", type=int, default=5, help="events changed before each briefing rebuild")
+    parser.add_argument("--iterations", type=int, default=20, help="briefing rebuilds")
+    parser.add_argument("--ai-messages", type=int, default=200)
+    parser.add_argument("--ai-chats", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=50, help="AI updates in flight")
+    parser.add_argument("--streaming", action="store_true", help="stream Gemini replies")
+    parser.add_argument("--chats", type=int, default=1000, help="broadcast subscribers")
+    parser.add_argument("--rounds", type=int, default=3, help="broadcast rounds")
+    parser.add_argument("--gemini-latency", type=float, default=0.5)
+    parser.add_argument("--caldav-latency", type=float, default=0.02)
+    parser.add_argument("--weather-latency", type=float, default=0.05)
+    parser.add_argument("--telegram-latency", type=float, default=0.01)
+    parser.add_argument("--telegram-rate", type=float, default=100000,
+                        help="messages/s for the rate limiter (Telegram's real limit is 30)")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    parser.add_argument("--verbose", action="store_true", help="keep the bot's INFO logs")
+    args = parser.parse_args()
+    args.scenarios = set(args.scenarios.split(","))
+
+    results = asyncio.run(run(args))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"\n{'scenario':<22}{'count':>8}{'per s':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for result in results:
+        print(f"{result['scenario']:<22}{result['count']:>8}{result['throughput_per_s']:>10}"
+              f"{result['p50_ms']:>10}{result['p99_ms']:>10}")
+        if "messages_per_s" in result:
+            print(f"{'':<22}{'':>8}{result['messages_per_s']:>10} messages/s")
+    print(f"\nUpstream requests: {results[-1]['upstream_requests'] if results else {}}")
+
+
+if __name__ == "__main__":
+    main()
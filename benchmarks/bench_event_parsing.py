@@ -0,0 +1,77 @@
+"""
+Micro-benchmark: full vobject parsing vs. the lightweight VEVENT extraction
+used by the calendar mirror, on a large recurring birthdays calendar.
+
+Usage: python benchmarks/bench_event_parsing.py [number_of_events] [rounds]
+"""
+import os
+import sys
+import time
+import random
+
+import vobject
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from calendar_mirror import index_resource
+
+NAMES = ["Anna", "Ben", "Clara", "David", "Emma", "Felix", "Greta", "Hannes", "Ida", "Jonas"]
+
+def make_birthday(i):
+    """Builds one resource as iCloud's birthdays calendar serves it."""
+    month = random.randint(1, 12)
+    day = random.randint(1, 27)
+    return (
+        "BEGIN:VCALENDAR\r\n"
+        "VERSION:2.0\r\n"
+        "PRODID:-//Apple Inc.//iPhone OS 17.0//EN\r\n"
+        "CALSCALE:GREGORIAN\r\n"
+        "BEGIN:VEVENT\r\n"
+        f"UID:birthday-{i}@icloud.com\r\n"
+        f"DTSTAMP:20240101T000000Z\r\n"
+        f"DTSTART;VALUE=DATE:{1970 + i % 40}{month:02d}{day:02d}\r\n"
+        f"DTEND;VALUE=DATE:{1970 + i % 40}{month:02d}{day + 1:02d}\r\n"
+        "RRULE:FREQ=YEARLY\r\n"
+        f"SUMMARY:Geburtstag {random.choice(NAMES)} {i}\r\n"
+        "TRANSP:TRANSPARENT\r\n"
+        "X-APPLE-UNIVERSAL-ID:0f1e2d3c-4b5a-6978-8796-a5b4c3d2e1f0\r\n"
+        "BEGIN:VALARM\r\n"
+        "ACTION:DISPLAY\r\n"
+        "DESCRIPTION:Erinnerung\r\n"
+        "TRIGGER;VALUE=DURATION:-PT15H\r\n"
+        "END:VALARM\r\n"
+        "END:VEVENT\r\n"
+        "END:VCALENDAR\r\n"
+    )
+
+def vobject_path(resources):
+    """What get_todays_events used to do for every event."""
+    for ical in resources:
+        vevent = vobject.readOne(ical).vevent
+        vevent.summary.value
+        vevent.dtstart.value
+
+def fast_path(resources):
+    for ical in resources:
+        index_resource(ical)
+
+def bench(fn, resources, rounds):
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        fn(resources)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    random.seed(42)
+    resources = [make_birthday(i) for i in range(count)]
+
+    slow = bench(vobject_path, resources, rounds)
+    fast = bench(fast_path, resources, rounds)
+
+    print(f"{count} recurring events, best of {rounds} rounds")
+    print(f"  vobject:     {slow * 1000:8.1f} ms  ({slow / count * 1e6:6.1f} us/event)")
+    print(f"  lightweight: {fast * 1000:8.1f} ms  ({fast / count * 1e6:6.1f} us/event)")
+    print(f"  speedup:     {slow / fast:8.1f}x")
@@ -0,0 +1,293 @@
+"""
+Local stand-ins for the services the bot talks to, for offline benchmarks.
+
+All HTTP fakes run on the benchmark's event loop, built on the bot's own
+KeepAliveServer. Each one records how many requests it served.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import datetime
+from xml.sax.saxutils import escape
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from keep_alive import KeepAliveServer, STATUS_TEXT
+
+
+class FakeServer(KeepAliveServer):
+    """KeepAliveServer on a free local port that sends every request to handle()."""
+
+    # WebDAV replies with 207, which the bot's own server never sends
+    status_text = {**STATUS_TEXT, 207: "Multi-Status"}
+
+    def __init__(self, latency=0.0):
+        super().__init__(port=0)
+        self.latency = latency
+        self.requests = 0
+
+    def route(self, request):
+        return self._serve
+
+    async def _serve(self, request):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return await self.handle(request)
+
+    async def handle(self, request):
+        raise NotImplementedError
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+
+class FakeOpenMeteo(FakeServer):
+    """Answers forecast requests for any number of coordinates."""
+
+    async def handle(self, request):
+        latitudes = request.query.get("latitude", "0").split(",")
+        forecasts = [
+            {
+                "latitude": float(latitude),
+                "current": {"temperature_2m": 12.3, "weather_code": 3},
+                "daily": {"weather_code": [3], "temperature_2m_max": [15.1], "temperature_2m_min": [7.4]},
+            }
+            for latitude in latitudes
+        ]
+        body = forecasts[0] if len(forecasts) == 1 else forecasts
+        return 200, "application/json", json.dumps(body).encode()
+
+
+def make_event(uid, index, today):
+    """One iCalendar resource: mostly timed events today, some yearly birthdays."""
+    if index % 3 == 0:
+        start = datetime.date(1980 + index % 40, today.month, today.day)
+        return (
+            "BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//Bench//EN\r\nBEGIN:VEVENT\r\n"
+            f"UID:{uid}\r\nDTSTAMP:20240101T000000Z\r\n"
+            f"DTSTART;VALUE=DATE:{start:%Y%m%d}\r\n"
+            "RRULE:FREQ=YEARLY\r\n"
+            f"SUMMARY:Geburtstag {index}\r\n"
+            "END:VEVENT\r\nEND:VCALENDAR\r\n"
+        )
+    day = today + datetime.timedelta(days=index % 5 - 2)
+    hour = 8 + index % 10
+    return (
+        "BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//Bench//EN\r\nBEGIN:VEVENT\r\n"
+        f"UID:{uid}\r\nDTSTAMP:20240101T000000Z\r\n"
+        f"DTSTART;TZID=Europe/Berlin:{day:%Y%m%d}T{hour:02d}0000\r\n"
+        f"DTEND;TZID=Europe/Berlin:{day:%Y%m%d}T{hour + 1:02d}0000\r\n"
+        f"SUMMARY:Termin {index}\r\n"
+        "END:VEVENT\r\nEND:VCALENDAR\r\n"
+    )
+
+
+def multistatus(responses, sync_token=None):
+    token = f"<d:sync-token>{sync_token}</d:sync-token>" if sync_token else ""
+    return (
+        '<?xml version="1.0" encoding="utf-8"?>'
+        '<d:multistatus xmlns:d="DAV:" xmlns:c="urn:ietf:params:xml:ns:caldav" xmlns:cs="http://calendarserver.org/ns/">'
+        + "".join(responses) + token + "</d:multistatus>"
+    ).encode()
+
+
+def propstat(href, props):
+    return (
+        f"<d:response><d:href>{escape(href)}</d:href><d:propstat><d:prop>{props}</d:prop>"
+        "<d:status>HTTP/1.1 200 OK</d:status></d:propstat></d:response>"
+    )
+
+
+class FakeCalDAV(FakeServer):
+    """
+    Minimal CalDAV server: principal and calendar discovery, sync-collection
+    with sync tokens, calendar-multiget and a plain calendar-query.
+    """
+
+    def __init__(self, calendars=3, events=100, latency=0.0):
+        super().__init__(latency)
+        today = datetime.date.today()
+        # calendar path -> {href: ical}
+        self.calendars = {}
+        for c in range(calendars):
+            path = f"/calendars/cal{c}/"
+            self.calendars[path] = {
+                f"{path}event{e}.ics": make_event(f"bench-{c}-{e}", e, today)
+                for e in range(events)
+            }
+        self.sync_token = "bench-1"
+
+    def touch(self, count=1):
+        """Changes `count` random events so the next sync has work to do."""
+        self.sync_token = f"bench-{int(self.sync_token.split('-')[1]) + 1}"
+        self.changed = set()
+        for _ in range(count):
+            path = random.choice(list(self.calendars))
+            href = random.choice(list(self.calendars[path]))
+            self.calendars[path][href] = self.calendars[path][href].replace("SUMMARY:", "SUMMARY:*", 1)
+            self.changed.add(href)
+
+    async def handle(self, request):
+        body = request.body.decode("utf-8", "replace")
+        path = request.path
+        if request.method == "PROPFIND":
+            return self.propfind(path, body, request.headers.get("depth", "0"))
+        if request.method == "REPORT" and path in self.calendars:
+            if "sync-collection" in body:
+                return self.sync_collection(path, body)
+            if "calendar-multiget" in body:
+                return self.multiget(path, body)
+            return self.query(path)
+        return 404, "text/plain", b"Not Found"
+
+    def propfind(self, path, body, depth):
+        if path in self.calendars:
+            return 207, "application/xml", multistatus([self.calendar_props(path)])
+        if path == "/calendars/":
+            responses = [propstat(path, "<d:resourcetype><d:collection/></d:resourcetype>")]
+            if depth != "0":
+                responses += [self.calendar_props(calendar) for calendar in self.calendars]
+            return 207, "application/xml", multistatus(responses)
+        if path.startswith("/principal"):
+            return 207, "application/xml", multistatus([propstat(
+                path,
+                "<c:calendar-home-set><d:href>/calendars/</d:href></c:calendar-home-set>"
+                "<d:current-user-principal><d:href>/principal/</d:href></d:current-user-principal>"
+                "<d:resourcetype><d:principal/></d:resourcetype>"
+            )])
+        return 207, "application/xml", multistatus([propstat(
+            path, "<d:current-user-principal><d:href>/principal/</d:href></d:current-user-principal>"
+        )])
+
+    def calendar_props(self, path):
+        return propstat(
+            path,
+            "<d:resourcetype><d:collection/><c:calendar/></d:resourcetype>"
+            f"<d:displayname>Bench {path.strip('/').split('/')[-1]}</d:displayname>"
+            '<c:supported-calendar-component-set><c:comp name="VEVENT"/></c:supported-calendar-component-set>'
+            f"<d:sync-token>{self.sync_token}</d:sync-token>"
+        )
+
+    def sync_collection(self, path, body):
+        token = body.split("<D:sync-token>")[-1].split("</D:sync-token>")[0] if "<D:sync-token>" in body else ""
+        if token == self.sync_token:
+            hrefs = []
+        elif token and getattr(self, "changed", None) is not None:
+            hrefs = [href for href in self.calendars[path] if href in self.changed]
+        else:
+            hrefs = list(self.calendars[path])
+        responses = [propstat(href, f'<d:getetag>"{hash(self.calendars[path][href])}"</d:getetag>') for href in hrefs]
+        return 207, "application/xml", multistatus(responses, self.sync_token)
+
+    def multiget(self, path, body):
+        events = self.calendars[path]
+        hrefs = [part.split("</")[0] for part in body.split("href>")[1::2]]
+        responses = [
+            propstat(href, f'<d:getetag>"{hash(events[href])}"</d:getetag>'
+                           f"<c:calendar-data>{escape(events[href])}</c:calendar-data>")
+            for href in hrefs if href in events
+        ]
+        return 207, "application/xml", multistatus(responses)
+
+    def query(self, path):
+        responses = [
+            propstat(href, f'<d:getetag>"{hash(ical)}"</d:getetag><c:calendar-data>{escape(ical)}</c:calendar-data>')
+            for href, ical in self.calendars[path].items()
+        ]
+        return 207, "application/xml", multistatus(responses)
+
+
+class FakeTelegram(FakeServer):
+    """Telegram Bot API sink that accepts every method and records sent texts."""
+
+    def __init__(self, latency=0.0):
+        super().__init__(latency)
+        self.sent = 0
+        self._message_id = 0
+        # Updates handed out by the next getUpdates call
+        self.updates = []
+
+    async def handle(self, request):
+        method = request.path.rsplit("/", 1)[-1]
+        content_type = request.headers.get("content-type", "")
+        if "json" in content_type:
+            data = json.loads(request.body or b"{}")
+        else:
+            from urllib.parse import parse_qsl
+            data = dict(parse_qsl(request.body.decode()))
+
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot",
+                      "can_join_groups": True, "can_read_all_group_messages": False,
+                      "supports_inline_queries": False}
+        elif method == "getUpdates":
+            if not self.updates:
+                # Short long-poll, so shutdown stays quick
+                await asyncio.sleep(0.5)
+            result, self.updates = self.updates, []
+        elif method in ("sendMessage", "editMessageText"):
+            self.sent += 1
+            self._message_id += 1
+            chat_id = int(data.get("chat_id", 0))
+            result = {
+                "message_id": int(data.get("message_id", self._message_id)),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": data.get("text", ""),
+            }
+        else:
+            result = True
+        return 200, "application/json", json.dumps({"ok": True, "result": result}).encode()
+
+
+class FakeGeminiChat:
+    """Stands in for a google.generativeai ChatSession, history included."""
+
+    def __init__(self, latency, history=(), chunks=5):
+        self.latency = latency
+        self.chunks = chunks
+        self.history = [FakeContent(role, text) for role, text in history]
+
+    async def send_message_async(self, text, stream=False):
+        self.history.append(FakeContent("user", text))
+        if not stream:
+            await asyncio.sleep(self.latency)
+            reply = f"Antwort auf: {text}"
+            self.history.append(FakeContent("model", reply))
+            return FakeGeminiResponse(reply)
+        return self._stream(text)
+
+    async def _stream(self, text):
+        reply = ""
+        for i in range(self.chunks):
+            await asyncio.sleep(self.latency / self.chunks)
+            chunk = f"Teil {i} der Antwort auf: {text}. "
+            reply += chunk
+            yield FakeGeminiResponse(chunk)
+        self.history.append(FakeContent("model", reply))
+
+
+class FakeGeminiResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeContent:
+    def __init__(self, role, text):
+        self.role = role
+        self.parts = [FakeGeminiResponse(text)]
+
+
+class FakeGeminiModel:
+    """Stands in for a google.generativeai GenerativeModel."""
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    async def generate_content_async(self, prompt):
+        await asyncio.sleep(self.latency)
+        return FakeGeminiResponse("Ich liebe dich! ❤️")
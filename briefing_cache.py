@@ -0,0 +1,68 @@
+import asyncio
+import datetime
+import logging
+import time
+
+from dateutil import tz
+
+
+class BriefingCache:
+    """
+    Calendar block of the briefing, cached per account and local date.
+
+    `build()` produces it, `versions()` returns a tuple that changes whenever
+    the source (the calendar mirror) changed. An entry is
+    served as long as it is from today and the source versions still match,
+    concurrent misses share one build.
+    """
+
+    def __init__(self, build, versions, timezone="Europe/Berlin"):
+        self.build = build
+        self.versions = versions
+        self.tz_info = tz.gettz(timezone)
+        # account -> (date, versions, parts)
+        self._entries = {}
+        # account -> asyncio.Task of the running build
+        self._building = {}
+
+    def _today(self):
+        return datetime.datetime.now(self.tz_info).date()
+
+    def peek(self, account):
+        """Returns the cached parts if they are still valid, without building."""
+        entry = self._entries.get(account)
+        if entry and entry[0] == self._today() and entry[1] == self.versions():
+            return entry[2]
+        return None
+
+    async def get(self, account):
+        """Returns the parts for today, building them on a miss."""
+        parts = self.peek(account)
+        if parts is not None:
+            return parts
+        return await self.refresh(account)
+
+    async def refresh(self, account):
+        """Rebuilds the entry for today (e.g. from the warm-up job)."""
+        task = self._building.get(account)
+        if task is None:
+            task = asyncio.ensure_future(self._build(account))
+            self._building[account] = task
+            task.add_done_callback(lambda _: self._building.pop(account, None))
+        return await asyncio.shield(task)
+
+    async def _build(self, account):
+        started = time.monotonic()
+        today = self._today()
+        parts = await self.build()
+        # Versions are read after the build, which itself syncs the sources
+        self._entries[account] = (today, self.versions(), parts)
+        logging.info(f"Briefing for {today} built in {time.monotonic() - started:.2f}s")
+        return parts
+
+    def invalidate(self, account=None):
+        """Drops one account's entry, or all entries."""
+        if account is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(account, None)
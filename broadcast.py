@@ -0,0 +1,54 @@
+import asyncio
+import logging
+import time
+
+from metrics import broadcast_duration, broadcast_messages
+
+
+class BroadcastScheduler:
+    """
+    Delivers one kind of scheduled message to many chats at once.
+
+    The scheduler tick passes the chats of a due delivery slot to `deliver()`.
+    There, `prepare(chat_ids)` builds the shared parts (weather,
+    calendar) exactly once, `render(shared, chat_id)` turns them into each chat's
+    text and the messages are sent with bounded concurrency. `send_kwargs` are
+    passed to every send_message call (e.g. the rate limiter priority).
+    """
+
+    def __init__(self, kind, prepare, render, max_concurrency=20, send_kwargs=None):
+        self.kind = kind
+        self.prepare = prepare
+        self.render = render
+        self.max_concurrency = max_concurrency
+        self.send_kwargs = send_kwargs or {}
+
+    async def deliver(self, bot, chat_ids):
+        """Builds the shared content once and sends it to all chat_ids."""
+        if not chat_ids:
+            return
+
+        started = time.monotonic()
+        shared = await self.prepare(chat_ids)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def send(chat_id):
+            async with semaphore:
+                await bot.send_message(chat_id=chat_id, text=self.render(shared, chat_id), **self.send_kwargs)
+
+        results = await asyncio.gather(*(send(chat_id) for chat_id in chat_ids), return_exceptions=True)
+
+        failed = 0
+        for chat_id, result in zip(chat_ids, results):
+            if isinstance(result, Exception):
+                failed += 1
+                logging.error(f"Broadcast {self.kind} to {chat_id} failed: {result}")
+
+        elapsed = time.monotonic() - started
+        broadcast_duration.observe(elapsed, kind=self.kind)
+        broadcast_messages.inc(len(chat_ids) - failed, kind=self.kind, outcome="ok")
+        broadcast_messages.inc(failed, kind=self.kind, outcome="error")
+        logging.info(
+            f"Broadcast {self.kind}: {len(chat_ids) - failed}/{len(chat_ids)} delivered "
+            f"in {elapsed:.2f}s"
+        )
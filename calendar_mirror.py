@@ -0,0 +1,472 @@
+import datetime
+import logging
+import re
+import threading
+from collections import defaultdict
+
+from dateutil import tz
+from dateutil.rrule import rrulestr
+
+import storage
+
+# Bump when the index layout changes; the mirror is then rebuilt from the server
+SCHEMA_VERSION = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS calendar_state (
+    account TEXT NOT NULL,
+    calendar_url TEXT NOT NULL,
+    name TEXT,
+    sync_token TEXT,
+    PRIMARY KEY (account, calendar_url)
+);
+CREATE TABLE IF NOT EXISTS calendar_events (
+    account TEXT NOT NULL,
+    calendar_url TEXT NOT NULL,
+    href TEXT NOT NULL,
+    uid TEXT,
+    recurrence_id TEXT,
+    summary TEXT,
+    dtstart TEXT NOT NULL,
+    dtend TEXT,
+    tzid TEXT,
+    all_day INTEGER NOT NULL,
+    rrule TEXT,
+    exdates TEXT
+);
+CREATE INDEX IF NOT EXISTS calendar_events_href ON calendar_events (account, calendar_url, href);
+CREATE INDEX IF NOT EXISTS calendar_events_start ON calendar_events (account, dtstart);
+"""
+
+
+# calendar-multiget REPORTs are split into batches of this many resources
+MULTIGET_BATCH_SIZE = 100
+
+_ESCAPED = re.compile(r'\\([\\;,nN])')
+
+
+def _unescape(text):
+    return _ESCAPED.sub(lambda m: "\n" if m.group(1) in "nN" else m.group(1), text)
+
+
+def _split_property(line):
+    """Splits 'NAME;PARAM=x:value' into (name, params, value)."""
+    in_quotes = False
+    for i, char in enumerate(line):
+        if char == '"':
+            in_quotes = not in_quotes
+        elif char == ':' and not in_quotes:
+            head, value = line[:i], line[i + 1:]
+            break
+    else:
+        return None, {}, ""
+    name, *raw_params = head.split(';')
+    params = {}
+    for param in raw_params:
+        key, _, param_value = param.partition('=')
+        params[key.upper()] = param_value.strip('"')
+    return name.upper(), params, value
+
+
+def _parse_ical_value(text, tzid=None):
+    """Serializes an iCalendar DATE or DATE-TIME as (iso wall time, tzid, all_day)."""
+    text = text.strip()
+    if len(text) == 8:
+        return f"{text[0:4]}-{text[4:6]}-{text[6:8]}", "", True
+    wall = f"{text[0:4]}-{text[4:6]}-{text[6:8]}T{text[9:11]}:{text[11:13]}:{text[13:15]}"
+    if text.endswith('Z'):
+        return wall, "UTC", False
+    if tzid and tz.gettz(tzid) is not None:
+        return wall, tzid, False
+    # Floating time or an unknown zone name (e.g. Windows names): taken as local time
+    return wall, "", False
+
+
+def _to_zone(wall, from_tzid, to_tzid):
+    """Converts an iso wall time between zones (both may be empty for local time)."""
+    if from_tzid == to_tzid or not from_tzid or not to_tzid:
+        return wall
+    value = datetime.datetime.fromisoformat(wall).replace(tzinfo=tz.gettz(from_tzid))
+    return value.astimezone(tz.gettz(to_tzid)).replace(tzinfo=None).isoformat()
+
+
+def _parse_value(text, tzid, all_day, tz_info):
+    """Inverse of _parse_ical_value; floating times are taken as local time."""
+    if all_day:
+        return datetime.date.fromisoformat(text)
+    value = datetime.datetime.fromisoformat(text)
+    return value.replace(tzinfo=tz.gettz(tzid) if tzid else tz_info)
+
+
+def index_resource(ical):
+    """
+    Extracts the index rows (one per VEVENT) from a calendar resource.
+
+    Only the properties the briefing needs are read, straight from the
+    unfolded content lines, without building a full vobject tree.
+    """
+    rows = []
+    props = None
+    nested = 0
+    for line in re.sub(r'\r?\n[ \t]', '', ical).splitlines():
+        if props is None:
+            if line.upper() == "BEGIN:VEVENT":
+                props = {'EXDATE': []}
+            continue
+        upper = line.upper()
+        if upper.startswith("BEGIN:"):
+            # VALARM and friends carry their own SUMMARY etc.
+            nested += 1
+            continue
+        if upper.startswith("END:"):
+            if nested:
+                nested -= 1
+                continue
+            if 'DTSTART' in props:
+                rows.append(_build_row(props))
+            props = None
+            continue
+        if nested:
+            continue
+        name, params, value = _split_property(line)
+        if name == 'EXDATE':
+            props['EXDATE'].append((params, value))
+        elif name in ('UID', 'SUMMARY', 'DTSTART', 'DTEND', 'RRULE', 'RECURRENCE-ID'):
+            props[name] = (params, value)
+    return rows
+
+
+def _build_row(props):
+    start_params, start_value = props['DTSTART']
+    dtstart, tzid, all_day = _parse_ical_value(start_value, start_params.get('TZID'))
+    # Raises ValueError for malformed values, so the resource is skipped at index time
+    _parse_value(dtstart, tzid, all_day, None)
+
+    dtend = ""
+    if 'DTEND' in props:
+        end_params, end_value = props['DTEND']
+        end_wall, end_tzid, _ = _parse_ical_value(end_value, end_params.get('TZID'))
+        dtend = _to_zone(end_wall, end_tzid, tzid)
+
+    # EXDATE and RECURRENCE-ID are stored as wall time in DTSTART's zone,
+    # which is what the expanded instances are compared against
+    exdates = []
+    for params, value in props['EXDATE']:
+        for item in value.split(','):
+            wall, item_tzid, _ = _parse_ical_value(item, params.get('TZID'))
+            exdates.append(_to_zone(wall, item_tzid, tzid))
+
+    recurrence_id = ""
+    if 'RECURRENCE-ID' in props:
+        params, value = props['RECURRENCE-ID']
+        wall, item_tzid, _ = _parse_ical_value(value, params.get('TZID'))
+        recurrence_id = _to_zone(wall, item_tzid, tzid)
+
+    return {
+        'uid': props['UID'][1].strip() if 'UID' in props else "",
+        'recurrence_id': recurrence_id,
+        'summary': _unescape(props['SUMMARY'][1]) if 'SUMMARY' in props else "",
+        'dtstart': dtstart,
+        'dtend': dtend,
+        'tzid': tzid,
+        'all_day': all_day,
+        'rrule': props['RRULE'][1].strip() if 'RRULE' in props else "",
+        'exdates': ",".join(exdates),
+    }
+
+
+def _fast_forward(rrule, base, window_start):
+    """
+    Moves the start of a plain yearly rule (no COUNT, no INTERVAL) to the year
+    before the window. The instances stay the same, but birthdays from decades
+    ago no longer expand every year since then.
+    """
+    rule = rrule.upper()
+    if "FREQ=YEARLY" not in rule or "COUNT=" in rule or re.search(r"INTERVAL=(?!1(;|$))", rule):
+        return base
+    year = window_start.year - 1
+    if base.year >= year:
+        return base
+    try:
+        return base.replace(year=year)
+    except ValueError:
+        # February 29th
+        return base
+
+
+def _expand(rrule, base, window):
+    """Expands an RRULE within window, tolerating UNTIL values of the wrong kind."""
+    # dateutil rejects the vendor extensions (X-...) that RFC 5545 allows in a rule
+    rrule = ";".join(part for part in rrule.split(";") if not part.upper().startswith("X-"))
+    base = _fast_forward(rrule, base, window[0])
+    try:
+        return rrulestr(rrule, dtstart=base).between(*window, inc=True)
+    except ValueError:
+        # dateutil insists that UNTIL and DTSTART are both naive or both aware
+        if base.tzinfo is None:
+            rrule = re.sub(r'(UNTIL=[0-9T]+)Z', r'\1', rrule)
+        else:
+            rrule = re.sub(r'UNTIL=(\d{8})(;|$)', r'UNTIL=\1T235959Z\2', rrule)
+            rrule = re.sub(r'(UNTIL=\d{8}T\d{6})(;|$)', r'\1Z\2', rrule)
+        return rrulestr(rrule, dtstart=base).between(*window, inc=True)
+
+
+class CalendarMirror:
+    """
+    Local SQLite copy of the CalDAV calendars.
+
+    Each calendar is kept current with sync-collection REPORTs, so a warm sync
+    costs one cheap request and only changed or deleted resources are
+    transferred. Event queries are answered from the local index.
+    """
+
+    def __init__(self, path=None):
+        self._conn = storage.connect(path)
+        self._lock = threading.Lock()
+        # (account, timezone) -> EventWindow
+        self._windows = {}
+        # Bumped whenever the mirrored events change, so caches can tell they are stale
+        self.generation = 0
+        if self._conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            # The mirror is only a cache of the server, so rebuild it from scratch
+            self._conn.executescript(
+                "DROP TABLE IF EXISTS calendar_events; DROP TABLE IF EXISTS calendar_state;"
+            )
+            self._conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self._conn.executescript(SCHEMA)
+
+    def _get_token(self, account, calendar_url):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT sync_token FROM calendar_state WHERE account = ? AND calendar_url = ?",
+                (account, calendar_url)
+            ).fetchone()
+        return row[0] if row else None
+
+    def sync_calendar(self, account, calendar):
+        """Pulls the changes of one calendar since the last sync. Returns the number of changed resources."""
+        from caldav.lib import error as caldav_error
+
+        calendar_url = str(calendar.url)
+        token = self._get_token(account, calendar_url)
+        try:
+            collection = calendar.objects_by_sync_token(sync_token=token, load_objects=False)
+        except caldav_error.DAVError as e:
+            if token is None:
+                raise
+            # Expired or invalid token: fall back to a full resync
+            logging.warning(f"Sync token for {calendar_url} rejected ({e}), resyncing")
+            token = None
+            collection = calendar.objects_by_sync_token(sync_token=None, load_objects=False)
+
+        bodies = {}
+        missing = []
+        for obj in collection:
+            if obj.data is None:
+                missing.append(obj.url)
+            else:
+                bodies[str(obj.url)] = obj.data
+
+        # Fetch the changed resources in bulk; whatever the server no longer has was deleted
+        deleted = []
+        for i in range(0, len(missing), MULTIGET_BATCH_SIZE):
+            batch = missing[i:i + MULTIGET_BATCH_SIZE]
+            fetched = {str(obj.url): obj.data for obj in calendar.calendar_multiget(batch) if obj.data}
+            bodies.update(fetched)
+            deleted.extend(str(url) for url in batch if str(url) not in fetched)
+
+        changed = {}
+        for href, data in bodies.items():
+            try:
+                changed[href] = index_resource(data)
+            except Exception as e:
+                logging.warning(f"Skipping event due to parse error: {e}")
+                deleted.append(href)
+
+        # Without sync support caldav emulates tokens ("fake-...") and returns
+        # the whole calendar whenever anything changed
+        sync_token = collection.sync_token
+        full = token is None or (str(sync_token).startswith("fake-") and bool(changed or deleted))
+        self._apply(account, calendar_url, getattr(calendar, 'name', None), sync_token,
+                    changed, deleted, full=full)
+        return len(changed) + len(deleted)
+
+    def _apply(self, account, calendar_url, name, sync_token, changed, deleted, full=False):
+        with self._lock, self._conn:
+            if full:
+                self._conn.execute(
+                    "DELETE FROM calendar_events WHERE account = ? AND calendar_url = ?",
+                    (account, calendar_url)
+                )
+            for href in list(changed) + deleted:
+                self._conn.execute(
+                    "DELETE FROM calendar_events WHERE account = ? AND calendar_url = ? AND href = ?",
+                    (account, calendar_url, href)
+                )
+            for href, rows in changed.items():
+                self._conn.executemany(
+                    "INSERT INTO calendar_events (account, calendar_url, href, uid, recurrence_id, summary, "
+                    "dtstart, dtend, tzid, all_day, rrule, exdates) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (account, calendar_url, href, row['uid'], row['recurrence_id'], row['summary'],
+                         row['dtstart'], row['dtend'], row['tzid'], int(row['all_day']), row['rrule'],
+                         row['exdates'])
+                        for row in rows
+                    ]
+                )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO calendar_state (account, calendar_url, name, sync_token) VALUES (?, ?, ?, ?)",
+                (account, calendar_url, name, sync_token)
+            )
+            if full or changed or deleted:
+                self.generation += 1
+
+    def prune(self, account, calendar_urls):
+        """Drops calendars that no longer exist on the server."""
+        keep = set(calendar_urls)
+        with self._lock, self._conn:
+            known = [row[0] for row in self._conn.execute(
+                "SELECT calendar_url FROM calendar_state WHERE account = ?", (account,)
+            )]
+            for calendar_url in known:
+                if calendar_url not in keep:
+                    self._conn.execute(
+                        "DELETE FROM calendar_events WHERE account = ? AND calendar_url = ?", (account, calendar_url)
+                    )
+                    self._conn.execute(
+                        "DELETE FROM calendar_state WHERE account = ? AND calendar_url = ?", (account, calendar_url)
+                    )
+                    self.generation += 1
+
+    def occurrences(self, account, start, end, tz_info):
+        """
+        Returns (dtstart, summary) for every event instance starting between
+        start and end (aware datetimes). All-day instances are returned as dates.
+        """
+        with self._lock:
+            # Overrides are always read: one moved out of the window still hides the master's instance
+            rows = self._conn.execute(
+                "SELECT uid, recurrence_id, summary, dtstart, tzid, all_day, rrule, exdates "
+                "FROM calendar_events WHERE account = ? "
+                "AND (rrule != '' OR recurrence_id != '' OR (dtstart >= ? AND dtstart <= ?))",
+                # Wall times are compared as text, so pad the range by a day for other time zones
+                (account, (start - datetime.timedelta(days=1)).date().isoformat(),
+                 (end + datetime.timedelta(days=1)).date().isoformat() + "T99")
+            ).fetchall()
+
+        overridden = {(row[0], row[1]) for row in rows if row[1]}
+        naive_start = start.astimezone(tz_info).replace(tzinfo=None)
+        naive_end = end.astimezone(tz_info).replace(tzinfo=None)
+
+        found = []
+        for uid, recurrence_id, summary, dtstart, tzid, all_day, rrule, exdates in rows:
+            try:
+                found.extend(self._row_occurrences(
+                    uid, summary, dtstart, tzid, all_day, rrule, exdates, overridden,
+                    (start, end), (naive_start, naive_end), tz_info
+                ))
+            except Exception as e:
+                # One broken event must not take the other events down with it
+                logging.warning(f"Skipping event {uid or summary} due to parse error: {e}")
+        return found
+
+    @staticmethod
+    def _row_occurrences(uid, summary, dtstart, tzid, all_day, rrule, exdates, overridden,
+                         aware_window, naive_window, tz_info):
+        base = _parse_value(dtstart, tzid, all_day, tz_info)
+        if all_day:
+            # All-day instances are compared as local wall time
+            base = datetime.datetime.combine(base, datetime.time())
+            window = naive_window
+        else:
+            window = aware_window
+
+        found = []
+        if rrule:
+            skip = set(exdates.split(",")) if exdates else set()
+            for instance in _expand(rrule, base, window):
+                key = instance.date().isoformat() if all_day else instance.replace(tzinfo=None).isoformat()
+                if key in skip or (uid, key) in overridden:
+                    continue
+                found.append((instance.date() if all_day else instance, summary))
+        elif window[0] <= base <= window[1]:
+            found.append((base.date() if all_day else base, summary))
+        return found
+
+    def window(self, account, first_date, days, timezone):
+        """
+        The EventWindow of `days` local dates from first_date. It is built once
+        and shared by all queries until the mirror changes or the day is over.
+        """
+        key = (account, timezone)
+        window = self._windows.get(key)
+        if window and window.valid(first_date, days, self.generation):
+            return window
+        generation = self.generation
+        tz_info = tz.gettz(timezone)
+        # Widen slightly to catch timezone edge cases for all-day events
+        start = datetime.datetime.combine(first_date, datetime.time(), tz_info) - datetime.timedelta(hours=2)
+        end = datetime.datetime.combine(
+            first_date + datetime.timedelta(days=days), datetime.time(), tz_info
+        ) + datetime.timedelta(hours=2)
+        window = EventWindow(first_date, days, tz_info, generation, self.occurrences(account, start, end, tz_info))
+        self._windows[key] = window
+        return window
+
+
+class EventWindow:
+    """
+    Rendered event lines of a span of local dates, indexed by date, so "today",
+    "tomorrow" and "this week" are all answered from the same data.
+    """
+
+    def __init__(self, first_date, days, tz_info, generation, occurrences):
+        self.first_date = first_date
+        self.days = days
+        self.generation = generation
+        last_date = first_date + datetime.timedelta(days=days - 1)
+
+        by_date = defaultdict(set)
+        for dtstart, summary in occurrences:
+            if isinstance(dtstart, datetime.datetime):
+                # Timed events count on their local start date
+                local_dt = dtstart.astimezone(tz_info)
+                event_date = local_dt.date()
+                time_str = local_dt.strftime("%H:%M")
+            else:
+                # All-day events count on their own date
+                event_date = dtstart
+                time_str = "Ganztägig"
+            if first_date <= event_date <= last_date:
+                # The set drops duplicates, e.g. one event in two calendars
+                by_date[event_date].add(f"• {time_str}: {summary}")
+        self._by_date = {event_date: sorted(lines) for event_date, lines in by_date.items()}
+
+    def valid(self, first_date, days, generation):
+        return self.first_date == first_date and self.days >= days and self.generation == generation
+
+    def events_on(self, event_date):
+        """Event lines of one local date, sorted by time (all-day last)."""
+        return self._by_date.get(event_date, [])
+
+    def events_between(self, first_date, last_date):
+        """{date: lines} for every date from first_date to last_date that has events."""
+        found = {}
+        day = first_date
+        while day <= last_date:
+            if day in self._by_date:
+                found[day] = self._by_date[day]
+            day += datetime.timedelta(days=1)
+        return found
+
+
+_mirror = None
+_mirror_lock = threading.Lock()
+
+def get_mirror():
+    """Returns the process-wide CalendarMirror."""
+    global _mirror
+    with _mirror_lock:
+        if _mirror is None:
+            _mirror = CalendarMirror()
+        return _mirror
@@ -1,126 +1,249 @@
+import os
 import caldav
 import datetime
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from caldav.lib import error as caldav_error
 from dateutil import tz
 
-def get_todays_events(email, password, timezone="Europe/Berlin"):
+from calendar_mirror import get_mirror
+from metrics import timed
+
+# iCloud CalDAV URL
+CALDAV_URL = os.getenv('ICLOUD_CALDAV_URL', "https://caldav.icloud.com")
+
+# Per-calendar syncs run concurrently on this pool
+CALDAV_MAX_WORKERS = int(os.getenv('CALDAV_MAX_WORKERS', 6))
+# Calendars whose sync runs longer than this are served from the local copy
+CALDAV_CALENDAR_TIMEOUT = float(os.getenv('CALDAV_CALENDAR_TIMEOUT', 10))
+# Days from today kept expanded in memory; today, tomorrow and the week are read from it
+CALENDAR_WINDOW_DAYS = max(7, int(os.getenv('CALENDAR_WINDOW_DAYS', 14)))
+
+_search_pool = ThreadPoolExecutor(max_workers=CALDAV_MAX_WORKERS, thread_name_prefix="caldav")
+
+class CalDAVSession:
     """
-    Fetches events for the current day from Apple Calendar (iCloud).
+    Long-lived CalDAV connection for one account.
+
+    The DAVClient (and its keep-alive HTTP session) is reused across calls and
+    the principal and calendar list are cached for `ttl` seconds, so warm calls
+    skip the PROPFIND discovery round trips completely.
     """
-    try:
-        # iCloud CalDAV URL
-        caldav_url = "https://caldav.icloud.com"
-        
-        client = caldav.DAVClient(
-            url=caldav_url,
+
+    def __init__(self, email, password, url=CALDAV_URL, ttl=3600):
+        self.account = email
+        self.password = password
+        self.ttl = ttl
+        self.client = caldav.DAVClient(
+            url=url,
             username=email,
-            password=password
+            password=password,
+            timeout=CALDAV_CALENDAR_TIMEOUT
         )
-        
-        principal = client.principal()
+        self._principal = None
+        self._calendars = None
+        self._expires_at = 0
+        self._lock = threading.Lock()
+
+    def calendars(self, refresh=False):
+        """Returns the cached calendar list, running discovery when stale."""
+        with self._lock:
+            if refresh or self._calendars is None or time.monotonic() >= self._expires_at:
+                with timed("caldav", "discovery"):
+                    if self._principal is None or refresh:
+                        self._principal = self.client.principal()
+                    self._calendars = self._principal.calendars()
+                self._expires_at = time.monotonic() + self.ttl
+            return self._calendars
+
+    def invalidate(self):
+        """Forgets the cached discovery so the next call rediscovers."""
+        with self._lock:
+            self._principal = None
+            self._calendars = None
+            self._expires_at = 0
+
+    def run(self, fn):
+        """Calls fn(calendars), rediscovering once on auth or not-found errors."""
         try:
-            calendars = principal.calendars()
-        except Exception as e:
+            return fn(self.calendars())
+        except (caldav_error.AuthorizationError, caldav_error.NotFoundError) as e:
+            logging.warning(f"CalDAV discovery outdated ({e}), refreshing")
+            self.invalidate()
+            return fn(self.calendars(refresh=True))
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def get_session(email, password):
+    """Returns the shared CalDAVSession for an account."""
+    with _sessions_lock:
+        session = _sessions.get(email)
+        if session is None or session.password != password:
+            session = CalDAVSession(email, password)
+            _sessions[email] = session
+        return session
+
+class CalendarError(Exception):
+    """A calendar query failed; the message is meant for the user."""
+
+def get_events(email, password, first_offset=0, days=1, timezone="Europe/Berlin"):
+    """
+    Returns {local date: event lines} for `days` days, starting `first_offset`
+    days from today. All queries are answered from one cached window of
+    CALENDAR_WINDOW_DAYS days. Raises CalendarError if the calendar could not be read.
+    """
+    try:
+        session = get_session(email, password)
+        try:
+            return session.run(lambda calendars: _collect_events(session, calendars, first_offset, days, timezone))
+        except (caldav_error.AuthorizationError, caldav_error.NotFoundError) as e:
             logging.error(f"Could not fetch calendars: {e}")
-            return "⚠️ Fehler beim Abrufen der Kalenderliste."
-        
-        if not calendars:
-            return "Keine Kalender gefunden."
+            raise CalendarError("⚠️ Fehler beim Abrufen der Kalenderliste.")
 
-        # Define the time range for "Today" in local time
-        tz_info = tz.gettz(timezone)
-        now = datetime.datetime.now(tz_info)
-        today_date = now.date()
-        
-        # Search window: Today 00:00 to 23:59 Local Time
-        # Widen slightly to catch timezone edge cases for all-day events
-        search_start = now.replace(hour=0, minute=0, second=0, microsecond=0) - datetime.timedelta(hours=2)
-        search_end = now.replace(hour=23, minute=59, second=59, microsecond=999999) + datetime.timedelta(hours=2)
+    except CalendarError:
+        raise
+    except Exception as e:
+        logging.error(f"CalDAV error: {e}")
+        raise CalendarError(f"Fehler beim Abrufen des Kalenders: {str(e)}")
 
-        events_found = []
-        
-        # Debug: Check which calendars we see
-        cal_names = [cal.name for cal in calendars] if calendars else []
-        logging.info(f"Found calendars: {cal_names}")
-
-        for calendar in calendars:
-            try:
-                # expand=True ensures recurring events (like birthdays) are expanded into instances
-                events = calendar.date_search(start=search_start, end=search_end, expand=True)
-                
-                for event in events:
-                    # Load the event details
-                    try:
-                        vobject = event.vobject_instance
-                        vevent = vobject.vevent
-                        summary = vevent.summary.value
-                        dtstart = vevent.dtstart.value
-                        
-                        # Normalize start time
-                        event_date = None
-                        time_str = ""
-                        is_all_day = False
-                        
-                        if isinstance(dtstart, datetime.datetime):
-                            # It's a specific time
-                            # Convert to local time
-                            if dtstart.tzinfo:
-                                local_dt = dtstart.astimezone(tz_info)
-                            else:
-                                # Assume local if no timezone
-                                local_dt = dtstart.replace(tzinfo=tz_info)
-                            
-                            event_date = local_dt.date()
-                            time_str = local_dt.strftime("%H:%M")
-                            
-                        elif isinstance(dtstart, datetime.date):
-                            # It's an all-day event
-                            event_date = dtstart
-                            is_all_day = True
-                            time_str = "Ganztägig"
-                            
-                        # FILTER: Check if the event happens TODAY
-                        # We accept events that start today, OR all-day events that match today.
-                        if event_date == today_date:
-                            events_found.append(f"• {time_str}: {summary}")
-                            
-                    except Exception as ev_e:
-                        logging.warning(f"Skipping event due to parse error: {ev_e}")
-                        continue
-
-            except Exception as e:
-                logging.error(f"Error reading calendar {calendar.name if hasattr(calendar, 'name') else 'unknown'}: {e}")
+def format_todays_events(events):
+    """Renders today's events as the calendar block of the briefing."""
+    if not events:
+        return "Heute stehen keine Termine im Kalender."
+    return "📅 **Deine Termine heute:**\n" + "\n".join(line for lines in events.values() for line in lines)
+
+def get_briefing_events(email, password, timezone="Europe/Berlin"):
+    """Today's events for the briefing; raises CalendarError, so a failure is never cached as the briefing."""
+    return format_todays_events(get_events(email, password, 0, 1, timezone))
+
+def get_todays_events(email, password, timezone="Europe/Berlin"):
+    """
+    Fetches events for the current day from Apple Calendar (iCloud).
+    """
+    try:
+        return get_briefing_events(email, password, timezone)
+    except CalendarError as e:
+        return str(e)
+
+def get_tomorrows_events(email, password, timezone="Europe/Berlin"):
+    """Fetches events for tomorrow."""
+    try:
+        events = get_events(email, password, 1, 1, timezone)
+    except CalendarError as e:
+        return str(e)
+    if not events:
+        return "Morgen stehen keine Termine im Kalender."
+    return "📅 **Deine Termine morgen:**\n" + "\n".join(line for lines in events.values() for line in lines)
+
+WEEKDAYS = ["Mo", "Di", "Mi", "Do", "Fr", "Sa", "So"]
+
+def get_week_events(email, password, timezone="Europe/Berlin"):
+    """Fetches the events of the next seven days, grouped by day."""
+    try:
+        events = get_events(email, password, 0, 7, timezone)
+    except CalendarError as e:
+        return str(e)
+    if not events:
+        return "In den nächsten 7 Tagen stehen keine Termine im Kalender."
+    days = [
+        f"*{WEEKDAYS[event_date.weekday()]}, {event_date.strftime('%d.%m.')}*\n" + "\n".join(lines)
+        for event_date, lines in events.items()
+    ]
+    return "📅 **Deine Termine der nächsten 7 Tage:**\n\n" + "\n\n".join(days)
+
+def _collect_events(session, calendars, first_offset, days, timezone):
+    """Brings the mirror up to date and reads the requested days from the event window."""
+    if not calendars:
+        raise CalendarError("Keine Kalender gefunden.")
+
+    # Debug: Check which calendars we see
+    cal_names = [cal.name for cal in calendars] if calendars else []
+    logging.info(f"Found calendars: {cal_names}")
+
+    # Bring the local mirror up to date; usually one cheap sync REPORT per calendar
+    mirror = get_mirror()
+    mirror.prune(session.account, [str(calendar.url) for calendar in calendars])
+    _sync_all(session, mirror, calendars)
+
+    # Local dates, so an event counts on the day it happens where the user is
+    today = datetime.datetime.now(tz.gettz(timezone)).date()
+    window = mirror.window(session.account, today, CALENDAR_WINDOW_DAYS, timezone)
+    first_date = today + datetime.timedelta(days=first_offset)
+    return window.events_between(first_date, first_date + datetime.timedelta(days=days - 1))
+
+# (account, calendar url) -> Future of the latest sync submitted for that calendar
+_syncs = {}
+_syncs_lock = threading.Lock()
+
+def _sync_all(session, mirror, calendars):
+    """
+    Syncs all calendars on the pool. Each sync gets CALDAV_CALENDAR_TIMEOUT
+    seconds from the moment it starts running; one still queued after
+    CALDAV_CALENDAR_TIMEOUT is given up too, so the wait stays bounded. A
+    calendar whose previous sync is still running is not submitted again and
+    is served from the mirror, so a hung calendar cannot fill the pool.
+    """
+    queue_deadline = time.monotonic() + CALDAV_CALENDAR_TIMEOUT
+    # index -> monotonic time the sync started on a worker
+    started = {}
+
+    def run(index, calendar):
+        started[index] = time.monotonic()
+        _sync_calendar(session, mirror, calendar)
+
+    def deadline(future):
+        index = futures[future]
+        return started[index] + CALDAV_CALENDAR_TIMEOUT if index in started else queue_deadline
+
+    futures = {}
+    with _syncs_lock:
+        for i, calendar in enumerate(calendars):
+            key = (session.account, str(calendar.url))
+            previous = _syncs.get(key)
+            if previous is not None and not previous.done():
+                logging.warning(f"Calendar {calendar.name if hasattr(calendar, 'name') else 'unknown'} is still syncing, using local copy")
                 continue
+            future = _search_pool.submit(run, i, calendar)
+            _syncs[key] = future
+            futures[future] = i
 
-        if not events_found:
-             # Add debug hint if no events found but calendars exist
-            if not calendars:
-                return "Debug: Keine Kalender gefunden. Prüfe Account-Daten."
-            return "Heute stehen keine Termine im Kalender."
-            
-        # Deduplicate results
-        unique_events = sorted(list(set(events_found)))
-        
-        return "📅 **Deine Termine heute:**\n" + "\n".join(unique_events)
+    pending = set(futures)
+    while pending:
+        timeout = max(0.0, min(deadline(f) for f in pending) - time.monotonic())
+        _, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        now = time.monotonic()
+        for future in [f for f in pending if deadline(f) <= now]:
+            pending.discard(future)
+            calendar = calendars[futures[future]]
+            # The sync keeps running in the background (each request is bounded by the
+            # DAVClient timeout); until it finishes the mirror holds the last known state
+            logging.warning(f"Calendar {calendar.name if hasattr(calendar, 'name') else 'unknown'} timed out, using local copy")
 
+def _sync_calendar(session, mirror, calendar):
+    """Pulls the changes of one calendar into the local mirror."""
+    try:
+        with timed("caldav", "sync"):
+            changed = mirror.sync_calendar(session.account, calendar)
+        if changed:
+            logging.info(f"Calendar {calendar.name if hasattr(calendar, 'name') else 'unknown'}: {changed} changed resources")
+    except (caldav_error.AuthorizationError, caldav_error.NotFoundError) as e:
+        # The cached calendar list is outdated, rediscover on the next call
+        logging.error(f"Calendar {calendar.name if hasattr(calendar, 'name') else 'unknown'} is gone: {e}")
+        session.invalidate()
     except Exception as e:
-        logging.error(f"CalDAV error: {e}")
-        return f"Fehler beim Abrufen des Kalenders: {str(e)}"
+        logging.error(f"Error reading calendar {calendar.name if hasattr(calendar, 'name') else 'unknown'}: {e}")
 
 def list_available_calendars(email, password):
     """
     Returns a list of names of all available calendars.
     """
     try:
-        caldav_url = "https://caldav.icloud.com"
-        client = caldav.DAVClient(
-            url=caldav_url,
-            username=email,
-            password=password
-        )
-        principal = client.principal()
+        session = get_session(email, password)
         try:
-            calendars = principal.calendars()
+            calendars = session.calendars()
         except Exception as e:
             logging.error(f"Could not fetch calendars: {e}")
             return ["⚠️ Fehler: Konnte Kalender-Liste nicht abrufen."]
@@ -0,0 +1,216 @@
+import os
+import asyncio
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import storage
+
+# Most chat sessions kept in memory; the least recently used one is dropped beyond that
+CHAT_MAX_SESSIONS = int(os.getenv('CHAT_MAX_SESSIONS', 500))
+# Sessions unused for this long are dropped
+CHAT_IDLE_SECONDS = int(os.getenv('CHAT_IDLE_SECONDS', 6 * 3600))
+# Characters of history sent with every turn; older turns are dropped beyond that
+CHAT_HISTORY_CHARS = int(os.getenv('CHAT_HISTORY_CHARS', 12000))
+# Turns older than this are deleted from disk
+CHAT_RETENTION_DAYS = int(os.getenv('CHAT_RETENTION_DAYS', 90))
+
+
+def _content_chars(content):
+    return sum(len(getattr(part, 'text', '') or '') for part in content.parts)
+
+
+class ChatHistoryDB:
+    """
+    Disk-backed log of chat turns.
+
+    All database work runs on one writer thread in submission order, so
+    appending a turn never blocks the reply path and a later load always
+    sees the turns written before it.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS chat_turns (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id INTEGER NOT NULL,
+        role TEXT NOT NULL,
+        text TEXT NOT NULL,
+        created_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS chat_turns_chat ON chat_turns (chat_id, id);
+    """
+
+    def __init__(self, path=None):
+        self._path = path
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="chat-history", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        conn = storage.connect(self._path)
+        conn.executescript(self.SCHEMA)
+        writes = 0
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            fn, args, future = item
+            try:
+                with conn:
+                    result = fn(conn, *args)
+                if future is not None:
+                    future.set_result(result)
+            except Exception as e:
+                logging.error(f"Chat history error: {e}")
+                if future is not None:
+                    future.set_exception(e)
+            writes += 1
+            if writes % 1000 == 0:
+                with conn:
+                    conn.execute(
+                        "DELETE FROM chat_turns WHERE created_at < ?",
+                        (time.time() - CHAT_RETENTION_DAYS * 86400,)
+                    )
+        conn.close()
+
+    def _submit(self, fn, *args, result=False):
+        future = Future() if result else None
+        self._queue.put((fn, args, future))
+        return future
+
+    @staticmethod
+    def _append(conn, chat_id, turns):
+        conn.executemany(
+            "INSERT INTO chat_turns (chat_id, role, text, created_at) VALUES (?, ?, ?, ?)",
+            [(chat_id, role, text, time.time()) for role, text in turns]
+        )
+
+    @staticmethod
+    def _clear(conn, chat_id):
+        conn.execute("DELETE FROM chat_turns WHERE chat_id = ?", (chat_id,))
+
+    @staticmethod
+    def _load(conn, chat_id, max_chars):
+        turns = []
+        total = 0
+        rows = conn.execute(
+            "SELECT role, text FROM chat_turns WHERE chat_id = ? ORDER BY id DESC", (chat_id,)
+        )
+        for role, text in rows:
+            total += len(text)
+            if total > max_chars:
+                break
+            turns.append((role, text))
+        turns.reverse()
+        # A history has to start with a user turn
+        while turns and turns[0][0] != 'user':
+            turns.pop(0)
+        return turns
+
+    def append(self, chat_id, *turns):
+        """Queues (role, text) turns for writing and returns immediately."""
+        self._submit(self._append, chat_id, turns)
+
+    def clear(self, chat_id):
+        self._submit(self._clear, chat_id)
+
+    async def load(self, chat_id, max_chars):
+        """Returns the newest (role, text) turns of a chat that fit into max_chars, without blocking the event loop."""
+        return await asyncio.wrap_future(self._submit(self._load, chat_id, max_chars, result=True))
+
+    def close(self, timeout=10):
+        """Writes everything queued so far, then stops the writer thread."""
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+
+class ChatSessionStore:
+    """
+    Bounded in-memory store of Gemini ChatSessions.
+
+    Keeps at most `max_sessions` sessions (LRU), drops sessions idle for longer
+    than `idle_seconds` and trims each history to `history_chars`, so memory
+    and the prompt size per turn stay flat over long uptimes.
+
+    With a `history_db`, turns are persisted and a session that is not in
+    memory (after a restart or eviction) is rebuilt from disk on first use.
+    `factory(history)` creates a session from a list of (role, text) turns.
+    """
+
+    def __init__(self, factory, history_db=None, max_sessions=CHAT_MAX_SESSIONS,
+                 idle_seconds=CHAT_IDLE_SECONDS, history_chars=CHAT_HISTORY_CHARS):
+        self.factory = factory
+        self.history_db = history_db
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self.history_chars = history_chars
+        # chat_id -> (last_used, session), least recently used first
+        self._sessions = OrderedDict()
+
+    def __contains__(self, chat_id):
+        return chat_id in self._sessions
+
+    def __len__(self):
+        return len(self._sessions)
+
+    async def get(self, chat_id):
+        """Returns the chat's session, creating it on first use."""
+        self.evict()
+        entry = self._sessions.pop(chat_id, None)
+        if entry:
+            session = entry[1]
+        else:
+            history = await self.history_db.load(chat_id, self.history_chars) if self.history_db else []
+            entry = self._sessions.pop(chat_id, None)
+            # Another caller may have rebuilt the session while the history loaded
+            session = entry[1] if entry else self.factory(history)
+        self._sessions[chat_id] = (time.monotonic(), session)
+        return session
+
+    def record(self, chat_id, user_text, reply_text):
+        """Persists one completed exchange (non-blocking) and compacts the session."""
+        if self.history_db:
+            self.history_db.append(chat_id, ('user', user_text), ('model', reply_text))
+        self.compact(chat_id)
+
+    def discard(self, chat_id):
+        """Forgets a chat's in-memory session only; the next turn rebuilds it from disk."""
+        self._sessions.pop(chat_id, None)
+
+    def reset(self, chat_id):
+        """Forgets a chat's session, in memory and on disk."""
+        self._sessions.pop(chat_id, None)
+        if self.history_db:
+            self.history_db.clear(chat_id)
+
+    def evict(self):
+        """Drops idle sessions and the least recently used ones beyond max_sessions."""
+        deadline = time.monotonic() - self.idle_seconds
+        while self._sessions:
+            chat_id, (last_used, _) = next(iter(self._sessions.items()))
+            if last_used >= deadline and len(self._sessions) < self.max_sessions:
+                break
+            del self._sessions[chat_id]
+            logging.info(f"Evicted chat session {chat_id}")
+
+    def compact(self, chat_id):
+        """Drops the oldest turns of a session until its history fits the budget."""
+        entry = self._sessions.get(chat_id)
+        if entry is None:
+            return
+        session = entry[1]
+        history = list(session.history)
+        total = sum(_content_chars(content) for content in history)
+        if total <= self.history_chars:
+            return
+
+        # Drop whole user/model exchanges so the history still starts with a user turn
+        start = 0
+        while total > self.history_chars and start < len(history) - 2:
+            total -= _content_chars(history[start]) + _content_chars(history[start + 1])
+            start += 2
+        session.history = history[start:]
+        logging.info(f"Compacted chat session {chat_id}: dropped {start} turns")
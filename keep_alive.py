@@ -1,19 +1,185 @@
-from http.server import HTTPServer, BaseHTTPRequestHandler
-from threading import Thread
 import os
+import asyncio
+import hmac
+import json
+import logging
+from urllib.parse import urlsplit, parse_qs
 
-class SimpleHandler(BaseHTTPRequestHandler):
-    def do_GET(self):
-        self.send_response(200)
-        self.end_headers()
-        self.wfile.write(b"Bot is active and running!")
-
-def run_server():
-    port = int(os.environ.get("PORT", 8080))
-    server = HTTPServer(("0.0.0.0", port), SimpleHandler)
-    print(f"Web server started on port {port}")
-    server.serve_forever()
-
-def start_keep_alive():
-    t = Thread(target=run_server, daemon=True)
-    t.start()
+from telegram import Update
+
+import metrics
+
+# Idle seconds before a kept-alive connection is closed
+KEEP_ALIVE_TIMEOUT = 30
+# Largest request body accepted; Telegram updates are far smaller
+MAX_BODY_BYTES = 1024 * 1024
+
+STATUS_TEXT = {
+    200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found",
+    409: "Conflict", 413: "Payload Too Large", 500: "Internal Server Error",
+}
+
+
+class PayloadTooLarge(Exception):
+    """Raised for a request whose Content-Length exceeds MAX_BODY_BYTES."""
+
+
+class Request:
+    """The parts of an HTTP request the handlers need."""
+
+    def __init__(self, method, target, headers, body):
+        url = urlsplit(target)
+        self.method = method
+        self.path = url.path
+        self.query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        self.headers = headers
+        self.body = body
+
+
+class KeepAliveServer:
+    """
+    Small asyncio HTTP server on the bot's event loop.
+
+    Answers Render's health checks, serves /metrics for Prometheus and, in
+    webhook mode, receives Telegram updates, so no extra thread or second server is needed. Handlers are
+    coroutines `handler(request)` returning (status, content_type, body).
+    """
+
+    status_text = STATUS_TEXT
+
+    def __init__(self, port=None):
+        self.port = port if port is not None else int(os.environ.get("PORT", 8080))
+        self._routes = {}
+        self._server = None
+        self._connections = set()
+        self.add_route("GET", "/", self.health)
+        self.add_route("GET", "/health", self.health)
+        self.add_route("GET", "/metrics", self.metrics)
+
+    def add_route(self, method, path, handler):
+        self._routes[(method, path)] = handler
+
+    async def health(self, request):
+        return 200, "text/plain", b"Bot is active and running!"
+
+    async def metrics(self, request):
+        return 200, "text/plain; version=0.0.4", metrics.render().encode()
+
+    def add_webhook(self, application, path, secret=None):
+        """Feeds POSTs on `path` into the application's update queue."""
+        async def webhook(request):
+            if secret and request.headers.get("x-telegram-bot-api-secret-token") != secret:
+                return 403, "text/plain", b"Forbidden"
+            try:
+                update = Update.de_json(json.loads(request.body), application.bot)
+            except Exception as e:
+                logging.warning(f"Invalid webhook payload: {e}")
+                return 400, "text/plain", b"Bad Request"
+            await application.update_queue.put(update)
+            return 200, "text/plain", b"OK"
+
+        self.add_route("POST", path, webhook)
+
+    def add_profiler(self, token, path="/debug/profile"):
+        """Serves on-demand CPU and memory profiles on `path`, for requests carrying `token`."""
+        async def profile(request):
+            given = request.query.get("token") or request.headers.get("x-profile-token") or ""
+            if not hmac.compare_digest(given.encode(), token.encode()):
+                return 403, "text/plain", b"Forbidden"
+            from profiling import profiler, ProfileBusy
+            try:
+                seconds = float(request.query.get("seconds", 10))
+            except ValueError:
+                return 400, "text/plain", b"Bad Request"
+            try:
+                report = await profiler.capture(seconds)
+            except ProfileBusy:
+                return 409, "text/plain", b"Profiling already running"
+            return 200, "text/plain; charset=utf-8", report.encode()
+
+        self.add_route("GET", path, profile)
+
+    def route(self, request):
+        """Returns the handler for a request, or None for 404."""
+        handler = self._routes.get((request.method, request.path))
+        if handler is None and request.method == "GET":
+            # Health checks may hit any path
+            handler = self.health
+        return handler
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, "0.0.0.0", self.port)
+        # Resolves port 0 to the port the OS picked
+        self.port = self._server.sockets[0].getsockname()[1]
+        print(f"Web server started on port {self.port}")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            # Idle kept-alive connections would otherwise wait for their timeout
+            for task in list(self._connections):
+                task.cancel()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _read_request(self, reader):
+        request_line = (await reader.readline()).decode("latin-1").strip()
+        if not request_line:
+            return None
+        method, target, _ = request_line.split(" ", 2)
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode("latin-1").strip()
+            if not line:
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length", 0))
+        if length > MAX_BODY_BYTES:
+            raise PayloadTooLarge()
+        body = await reader.readexactly(length) if length else b""
+        return Request(method.upper(), target, headers, body)
+
+    async def _respond(self, writer, status, content_type, body, close=False):
+        writer.write(
+            f"HTTP/1.1 {status} {self.status_text.get(status, '')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'close' if close else 'keep-alive'}\r\n\r\n".encode("latin-1") + body
+        )
+        await writer.drain()
+
+    async def _handle(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            # Keep the connection open for further requests (Telegram reuses it)
+            while True:
+                try:
+                    request = await asyncio.wait_for(self._read_request(reader), timeout=KEEP_ALIVE_TIMEOUT)
+                except PayloadTooLarge:
+                    # The unread body is still on the connection, so it cannot be reused
+                    await self._respond(writer, 413, "text/plain", b"Payload Too Large", close=True)
+                    return
+                if request is None:
+                    return
+                handler = self.route(request)
+                if handler is None:
+                    status, content_type, body = 404, "text/plain", b"Not Found"
+                else:
+                    try:
+                        status, content_type, body = await handler(request)
+                    except Exception as e:
+                        logging.error(f"Handler for {request.path} failed: {e}")
+                        status, content_type, body = 500, "text/plain", b"Internal Server Error"
+
+                close = request.headers.get("connection", "").lower() == "close"
+                await self._respond(writer, status, content_type, body, close)
+                if close:
+                    return
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.CancelledError,
+                ConnectionError, ValueError):
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
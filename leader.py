@@ -0,0 +1,102 @@
+import os
+import socket
+import sqlite3
+import logging
+import threading
+import time
+
+import storage
+
+# Seconds a lease stays valid without renewal; renewed every third of that
+LEADER_LEASE_SECONDS = float(os.getenv('LEADER_LEASE_SECONDS', 30))
+# Identifies this process in the lease table
+INSTANCE_ID = os.getenv('INSTANCE_ID') or f"{socket.gethostname()}-{os.getpid()}"
+
+
+class LeaderLease:
+    """
+    Time-limited lease in the shared SQLite database.
+
+    Several bot processes can run at once (e.g. while a redeploy overlaps the
+    old instance); only the one holding the lease runs the scheduled jobs. A
+    lease that is not renewed within `ttl` seconds can be taken over, so a
+    crashed leader is replaced automatically. The leader also stores how far
+    it got (`progress`), so its successor continues exactly there.
+
+    `is_leader` also turns false locally once the lease has run out without a
+    renewal (e.g. the event loop stalled), because by then another instance
+    may already have taken over.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS leases (
+        name TEXT PRIMARY KEY,
+        holder TEXT NOT NULL,
+        expires_at REAL NOT NULL,
+        progress REAL
+    );
+    """
+
+    def __init__(self, name, holder=INSTANCE_ID, ttl=LEADER_LEASE_SECONDS, path=None):
+        self.name = name
+        self.holder = holder
+        self.ttl = ttl
+        self._held = False
+        # Monotonic time until which our last successful acquire is valid
+        self._valid_until = 0.0
+        self._conn = storage.connect(path)
+        self._conn.executescript(self.SCHEMA)
+        self._lock = threading.Lock()
+
+    @property
+    def is_leader(self):
+        return self._held and time.monotonic() < self._valid_until
+
+    def try_acquire(self):
+        """Takes or renews the lease if it is free, expired or already ours. Returns whether we hold it."""
+        # Taken before the write, so the local expiry never outlasts the stored one
+        started = time.monotonic()
+        now = time.time()
+        try:
+            with self._lock, self._conn:
+                cursor = self._conn.execute(
+                    "INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at "
+                    "WHERE leases.holder = excluded.holder OR leases.expires_at < ?",
+                    (self.name, self.holder, now + self.ttl, now)
+                )
+                acquired = cursor.rowcount > 0
+        except sqlite3.Error as e:
+            # Without a confirmed renewal we must assume somebody else may take over
+            logging.error(f"Lease {self.name} renewal failed: {e}")
+            acquired = False
+
+        if acquired and not self.is_leader:
+            logging.info(f"{self.holder} is now leader for {self.name}")
+        elif not acquired and self._held:
+            logging.warning(f"{self.holder} lost the {self.name} lease")
+        self._held = acquired
+        self._valid_until = started + self.ttl if acquired else 0.0
+        return acquired
+
+    def release(self):
+        """Gives the lease up, so another instance can take over without waiting for expiry."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE leases SET expires_at = 0 WHERE name = ? AND holder = ?", (self.name, self.holder)
+            )
+        self._held = False
+        self._valid_until = 0.0
+
+    def progress(self):
+        """The last progress mark stored by any leader, or None."""
+        with self._lock:
+            row = self._conn.execute("SELECT progress FROM leases WHERE name = ?", (self.name,)).fetchone()
+        return row[0] if row else None
+
+    def save_progress(self, value):
+        """Stores a progress mark, only while we still hold the lease."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE leases SET progress = ? WHERE name = ? AND holder = ?", (value, self.name, self.holder)
+            )
@@ -0,0 +1,47 @@
+import threading
+
+import storage
+from weather_utils import snap
+
+
+class ChatLocations:
+    """Per-chat weather location, stored as its snapped grid cell."""
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS chat_locations (
+        chat_id INTEGER PRIMARY KEY,
+        latitude REAL NOT NULL,
+        longitude REAL NOT NULL
+    );
+    """
+
+    def __init__(self, path=None):
+        self._conn = storage.connect(path)
+        self._conn.executescript(self.SCHEMA)
+        self._lock = threading.Lock()
+
+    def set(self, chat_id, latitude, longitude):
+        """Stores a chat's location and returns the grid cell it was snapped to."""
+        cell = snap(latitude, longitude)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO chat_locations (chat_id, latitude, longitude) VALUES (?, ?, ?)",
+                (chat_id, *cell)
+            )
+        return cell
+
+    def get_many(self, chat_ids):
+        """Returns {chat_id: cell} for all chats in chat_ids that have a location."""
+        chat_ids = list(chat_ids)
+        cells = {}
+        with self._lock:
+            # Stay below SQLite's limit for bound parameters
+            for i in range(0, len(chat_ids), 500):
+                batch = chat_ids[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT chat_id, latitude, longitude FROM chat_locations "
+                    f"WHERE chat_id IN ({','.join('?' * len(batch))})",
+                    batch
+                )
+                cells.update({chat_id: (latitude, longitude) for chat_id, latitude, longitude in rows})
+        return cells
@@ -0,0 +1,180 @@
+import os
+import re
+import asyncio
+import logging
+import threading
+import time
+
+import storage
+from ai_utils import generate_content, get_model, load_genai
+
+# Models tried for love messages, best first
+LOVE_MODELS = os.getenv(
+    'LOVE_MODELS',
+    "gemini-flash-latest,gemini-2.0-flash-lite,gemini-1.5-flash,gemini-2.0-flash"
+).split(",")
+# Number of ready messages kept in the pool
+LOVE_POOL_SIZE = int(os.getenv('LOVE_POOL_SIZE', 5))
+# Seconds a single generation may take before it counts as failed
+LOVE_GENERATION_TIMEOUT = float(os.getenv('LOVE_GENERATION_TIMEOUT', 30))
+
+FALLBACK_MESSAGE = "Guten Morgen mein Schatz! ❤️ Ich liebe dich über alles!"
+
+# Static instructions, sent as the models' system instruction
+LOVE_INSTRUCTION = (
+    "Du schreibst kurze, liebevolle Guten-Morgen-Nachrichten an meine Freundin. "
+    "WICHTIG: Schreibe aus MEINER Perspektive (Ich-Form). "
+    "INHALT: Mischung aus Liebe und Motivation für den Tag. "
+    "Vermeide Kitsch, sei authentisch. "
+    "VERBOTEN: Platzhalter wie '[Dein Name]', '[Datum]' oder ähnliches. Nutze keine Platzhalter! "
+    "Unterschreibe NICHT oder nur mit 'Dein Schatz'. "
+    "Erwähne NIEMALS, dass du eine KI bist. "
+    "Antworte als reinen Text."
+)
+LOVE_PROMPT = "Schreibe die Guten-Morgen-Nachricht für heute."
+
+
+def clean_message(text):
+    """Removes HTML-like tags (including blockquote) and surrounding quotes."""
+    # Remove HTML tags
+    clean_text = re.sub(r'<[^>]+>', '', text).strip()
+    # Remove surrounding quotes if present
+    if clean_text.startswith('"') and clean_text.endswith('"'):
+        clean_text = clean_text[1:-1]
+    return clean_text
+
+
+class ModelHealth:
+    """
+    Recent latency and error rate of one model, plus a circuit breaker.
+
+    After `threshold` consecutive failures the breaker opens and the model is
+    skipped for `cooldown` seconds (doubling on every further failure, up to
+    `max_cooldown`). After the cooldown one trial call is let through.
+    """
+
+    def __init__(self, name, threshold=3, cooldown=300, max_cooldown=3600):
+        self.name = name
+        self.threshold = threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.latency = None
+        self.error_rate = 0.0
+        self.failures = 0
+        self.cooldown = cooldown
+        self.open_until = 0.0
+
+    def available(self):
+        return time.monotonic() >= self.open_until
+
+    def score(self):
+        """Lower is better; untried models come after measured ones, in LOVE_MODELS order."""
+        if self.latency is None:
+            return float('inf')
+        return self.latency * (1 + 5 * self.error_rate)
+
+    def record_success(self, latency):
+        self.latency = latency if self.latency is None else 0.7 * self.latency + 0.3 * latency
+        self.error_rate *= 0.7
+        self.failures = 0
+        self.cooldown = self.base_cooldown
+
+    def record_failure(self):
+        self.error_rate = 0.7 * self.error_rate + 0.3
+        self.failures += 1
+        if self.failures >= self.threshold:
+            self.open_until = time.monotonic() + self.cooldown
+            logging.warning(f"Circuit open for {self.name} for {self.cooldown}s")
+            self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+
+
+class LovePool:
+    """
+    Pre-generated love messages.
+
+    `refill()` runs in the background and fills the pool up to `size` using the
+    healthiest model; `take()` hands out a ready message without calling the
+    model. The pool is stored on disk so it survives restarts.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS love_pool (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        text TEXT NOT NULL,
+        model TEXT,
+        created_at REAL NOT NULL
+    );
+    """
+
+    def __init__(self, models=LOVE_MODELS, size=LOVE_POOL_SIZE, path=None):
+        self.models = [ModelHealth(name.strip()) for name in models if name.strip()]
+        self.size = size
+        self._conn = storage.connect(path)
+        self._conn.executescript(self.SCHEMA)
+        self._lock = threading.Lock()
+        self._refilling = None
+
+    def take(self):
+        """Returns the oldest pooled message, or the fixed fallback if the pool is empty."""
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT id, text FROM love_pool ORDER BY id LIMIT 1").fetchone()
+            if row:
+                self._conn.execute("DELETE FROM love_pool WHERE id = ?", (row[0],))
+        if row is None:
+            logging.warning("Love pool is empty, using fallback message")
+            return FALLBACK_MESSAGE
+        return row[1]
+
+    def _add(self, text, model):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO love_pool (text, model, created_at) VALUES (?, ?, ?)", (text, model, time.time())
+            )
+
+    def _candidates(self):
+        available = [model for model in self.models if model.available()]
+        return sorted(available, key=lambda model: (model.score(), self.models.index(model)))
+
+    async def generate(self):
+        """Generates one message, cascading through the models by health. Returns None if all fail."""
+        await load_genai()
+        for health in self._candidates():
+            started = time.monotonic()
+            try:
+                model = get_model(health.name, LOVE_INSTRUCTION)
+                response = await asyncio.wait_for(generate_content(model, LOVE_PROMPT), LOVE_GENERATION_TIMEOUT)
+                text = clean_message(response.text)
+                if not text:
+                    raise ValueError("empty response")
+            except Exception as e:
+                logging.error(f"Love message error with {health.name}: {e}")
+                health.record_failure()
+                continue
+            health.record_success(time.monotonic() - started)
+            return text, health.name
+        return None
+
+    async def refill(self):
+        """Tops the pool up to its target size; concurrent calls share one run."""
+        if self._refilling is None or self._refilling.done():
+            self._refilling = asyncio.ensure_future(self._refill())
+        await asyncio.shield(self._refilling)
+
+    async def _refill(self):
+        existing = set()
+        with self._lock:
+            existing.update(row[0] for row in self._conn.execute("SELECT text FROM love_pool"))
+        # Bounded, in case a model keeps repeating itself
+        for _ in range(self.size * 3):
+            if len(existing) >= self.size:
+                break
+            result = await self.generate()
+            if result is None:
+                logging.warning("No model available for love messages, retrying later")
+                return
+            text, model = result
+            if text in existing:
+                continue
+            self._add(text, model)
+            existing.add(text)
+        logging.info(f"Love pool filled with {len(existing)} messages")
@@ -1,120 +1,320 @@
+import time
+# Reference point for the startup report
+STARTED_AT = time.perf_counter()
+
 import os
-import re
+import asyncio
 import logging
 import datetime
-import requests
-import google.generativeai as genai
+import signal
 from dotenv import load_dotenv
-from keep_alive import start_keep_alive  # Import keep_alive
+
+if __name__ == '__main__':
+    # Load .env before the modules below read their configuration
+    load_dotenv()
+
+from keep_alive import KeepAliveServer
 
 from telegram import Update
-from telegram.ext import ApplicationBuilder, ContextTypes, CommandHandler, MessageHandler, filters
-from calendar_utils import get_todays_events, list_available_calendars
-
-# Load environment variables
-load_dotenv()
-
-# Start keep-alive server for Render
-start_keep_alive()
-
-# Configure Gemini
-GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
-if GOOGLE_API_KEY:
-    genai.configure(api_key=GOOGLE_API_KEY)
-else:
-    print("Warning: GOOGLE_API_KEY not found in .env")
-
-# Enable logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+from telegram.error import BadRequest
+from telegram.ext import ApplicationBuilder, ContextTypes, CommandHandler, MessageHandler, TypeHandler, filters
+from weather_utils import weather_provider, format_weather, HAMBURG
+from locations import ChatLocations
+from broadcast import BroadcastScheduler
+from subscriptions import SubscriptionRegistry, MinuteClock, BRIEFING, LOVE, DEFAULT_TIMEZONE
+from ai_utils import chat_lock, get_model, load_genai, send_chat_message, stream_chat_message
+from chat_store import ChatSessionStore, ChatHistoryDB
+from love_pool import LovePool
+from briefing_cache import BriefingCache
+from calendar_mirror import get_mirror
+from send_queue import PriorityRateLimiter, BROADCAST
+from metrics import StartupTimer
+from leader import LeaderLease, LEADER_LEASE_SECONDS
+
+startup = StartupTimer(STARTED_AT)
+
+# Model for AI chat replies, shared by all sessions
+GEMINI_CHAT_MODEL = os.getenv('GEMINI_CHAT_MODEL', 'gemini-flash-latest')
+
+def new_chat_session(history):
+    """Starts a Gemini chat, continuing from a list of (role, text) turns."""
+    model = get_model(GEMINI_CHAT_MODEL)
+    return model.start_chat(history=[{'role': role, 'parts': [text]} for role, text in history])
+
+# Stream AI replies into one message that is edited while Gemini writes
+GEMINI_STREAMING = os.getenv('GEMINI_STREAMING', '1') == '1'
+# Seconds between two edits of a streamed message (Telegram rate-limits edits)
+STREAM_EDIT_INTERVAL = float(os.getenv('STREAM_EDIT_INTERVAL', 1.0))
+# Telegram's maximum message length
+MAX_MESSAGE_LENGTH = 4096
 
-# Store chat sessions in memory: chat_id -> chat_session
-chat_sessions = {}
+# Database-backed state, opened by init_state() so that importing this module stays cheap.
+# Store chat sessions in memory: chat_id -> chat_session (bounded, see chat_store).
+# Turns are persisted, so sessions survive restarts and are rebuilt on first use.
+chat_sessions = None
+# Chats that shared their location get the weather of their grid cell instead of Hamburg
+chat_locations = None
+# Persistent subscriptions with per-chat delivery time and timezone
+subscriptions = None
+# Love messages are generated ahead of time, so sending one never waits for Gemini
+love_pool = None
+# Only the instance holding this lease runs the scheduled jobs
+scheduler_lease = None
 
-def get_weather_hamburg():
+def init_state():
+    """Opens the local database and loads the persistent state."""
+    global chat_sessions, chat_locations, subscriptions, love_pool, scheduler_lease
+    chat_sessions = ChatSessionStore(new_chat_session, ChatHistoryDB())
+    chat_locations = ChatLocations()
+    subscriptions = SubscriptionRegistry()
+    love_pool = LovePool()
+    scheduler_lease = LeaderLease("scheduler")
+
+WEATHER_ERROR = "⚠️ Wetter konnte nicht geladen werden."
+
+async def get_weather_hamburg():
     """Fetches simple weather data for Hamburg."""
     try:
-        # Hamburg coordinates
-        url = "https://api.open-meteo.com/v1/forecast?latitude=53.55&longitude=9.99&current=temperature_2m,weather_code&hourly=temperature_2m&daily=weather_code,temperature_2m_max,temperature_2m_min&timezone=Europe%2FBerlin&forecast_days=1"
-        response = requests.get(url)
-        data = response.json()
-        
-        current_temp = data['current']['temperature_2m']
-        max_temp = data['daily']['temperature_2m_max'][0]
-        min_temp = data['daily']['temperature_2m_min'][0]
-        
-        return (
-            f"🌦 **Wetter in Hamburg**\n"
-            f"Aktuell: {current_temp}°C\n"
-            f"Tageswerte: {min_temp}°C bis {max_temp}°C"
-        )
+        forecast = await weather_provider.get_forecast(*HAMBURG)
+        return format_weather(forecast)
     except Exception as e:
         logging.error(f"Weather error: {e}")
-        return "⚠️ Wetter konnte nicht geladen werden."
+        return WEATHER_ERROR
 
-def get_daily_briefing():
-    """Combines weather and calendar events for a daily briefing."""
-    weather = get_weather_hamburg()
-    
+async def get_local_weather(chat_ids):
+    """
+    Weather blocks for the chats in chat_ids that shared a location. All
+    distinct grid cells are fetched together in one request.
+    """
+    cells = chat_locations.get_many(chat_ids)
+    if not cells:
+        return {}
+    forecasts = await weather_provider.get_forecasts(cells.values())
+    return {
+        chat_id: format_weather(forecasts[cell], "an deinem Standort") if cell in forecasts else WEATHER_ERROR
+        for chat_id, cell in cells.items()
+    }
+
+async def get_briefing_parts():
+    """
+    The shared parts of the daily briefing (weather, calendar). The calendar
+    block comes from the briefing cache, the weather from the provider's own
+    cache, so a weather change never forces a calendar rebuild.
+    """
+    weather = await get_weather_hamburg()
+    try:
+        calendar_info = await briefing_cache.get(briefing_account())
+    except Exception as e:
+        # Failures are shown but not cached (the message is meant for the user)
+        calendar_info = str(e)
+    return weather, calendar_info
+
+async def get_briefing_calendar():
+    """Fetches today's calendar block of the briefing."""
     email = os.getenv('ICLOUD_EMAIL')
     password = os.getenv('ICLOUD_PASSWORD')
     
     if email and password:
-        calendar_info = get_todays_events(email, password)
-    else:
-        calendar_info = "⚠️ iCloud Zugangsdaten fehlen in der .env Datei."
-        
-    return f"{weather}\n\n{calendar_info}"
+        return await asyncio.to_thread(fetch_calendar_view, "get_briefing_events", email, password)
+    return "⚠️ iCloud Zugangsdaten fehlen in der .env Datei."
+
+def fetch_calendar_view(view, email, password):
+    """Calls one of calendar_utils' views, loading the CalDAV integration on first use; runs in a worker thread."""
+    import calendar_utils
+    return getattr(calendar_utils, view)(email, password)
+
+def render_briefing(parts, local_weather=None):
+    """Renders the briefing text from its shared parts, optionally with the chat's own weather."""
+    weather, calendar_info = parts
+    return f"{local_weather or weather}\n\n{calendar_info}"
+
+async def get_daily_briefing():
+    """Combines weather and calendar events for a daily briefing."""
+    return render_briefing(await get_briefing_parts())
+
+def briefing_sources_version():
+    """Changes whenever the mirrored calendar changed."""
+    return (get_mirror().generation,)
+
+# The calendar block is built once per day and rebuilt only when the calendar changed
+briefing_cache = BriefingCache(get_briefing_calendar, briefing_sources_version)
+
+# Minutes before a delivery slot at which the briefing is pre-built
+BRIEFING_WARMUP_MINUTES = int(os.getenv('BRIEFING_WARMUP_MINUTES', 5))
+# Minutes between background checks for calendar/weather changes
+BRIEFING_REFRESH_MINUTES = int(os.getenv('BRIEFING_REFRESH_MINUTES', 15))
+
+def briefing_account():
+    return os.getenv('ICLOUD_EMAIL') or ""
+
+async def warm_briefing():
+    """Syncs the sources and rebuilds the briefing so it is served from memory."""
+    try:
+        await briefing_cache.refresh(briefing_account())
+        await get_weather_hamburg()
+    except Exception as e:
+        logging.error(f"Briefing warm-up error: {e}")
+
+async def warm_briefing_cache(context: ContextTypes.DEFAULT_TYPE):
+    """Background job that keeps the cached briefing fresh during the day."""
+    await warm_briefing()
+
+async def prepare_morning_briefing(chat_ids):
+    """Shared parts for one delivery slot: the cached briefing plus every subscriber's local weather."""
+    return await get_briefing_parts(), await get_local_weather(chat_ids)
+
+def render_morning_briefing(shared, chat_id):
+    parts, local_weather = shared
+    return render_briefing(parts, local_weather.get(chat_id))
+
+# Delivered by the single scheduler tick, grouped by delivery slot
+morning_broadcast = BroadcastScheduler(
+    BRIEFING,
+    prepare_morning_briefing,
+    render_morning_briefing,
+    max_concurrency=int(os.getenv('BROADCAST_CONCURRENCY', 20)),
+    # Scheduled messages queue behind interactive replies
+    send_kwargs={'rate_limit_args': {'priority': BROADCAST}}
+)
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Sends a welcome message and schedules the daily job."""
     chat_id = update.effective_chat.id
     
     # Reset chat session on start
-    if chat_id in chat_sessions:
-        del chat_sessions[chat_id]
-
-    # Schedule the daily morning message
-    current_jobs = context.job_queue.get_jobs_by_name(str(chat_id))
-    for job in current_jobs:
-        job.schedule_removal()
-        
-    context.job_queue.run_daily(
-        send_morning_message, 
-        time=datetime.time(hour=7, minute=00), 
-        chat_id=chat_id, 
-        name=str(chat_id),
-        data=chat_id
-    )
+    chat_sessions.reset(chat_id)
+
+    # Schedule the daily morning message (keeps an already chosen time)
+    if subscriptions.get(chat_id, BRIEFING) is None:
+        subscriptions.subscribe(chat_id, BRIEFING)
+    delivery_time, _ = subscriptions.get(chat_id, BRIEFING)
 
     await context.bot.send_message(
         chat_id=chat_id,
         text=f"👋 Hallo! Ich bin dein AI-Assistent.\n"
-             f"Dein Briefing kommt täglich um 07:00 Uhr.\n"
+             f"Dein Briefing kommt täglich um {delivery_time.strftime('%H:%M')} Uhr (ändern mit /time).\n"
+             f"Teile deinen Standort mit mir, dann bekommst du das Wetter für deinen Ort.\n"
              f"Du kannst mit mir ganz normal schreiben, ich antworte dir mit der Power von Google Gemini."
     )
 
+async def time_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Sets the delivery time (and optionally the timezone) of the daily briefing."""
+    chat_id = update.effective_chat.id
+    try:
+        delivery_time = datetime.datetime.strptime(context.args[0], "%H:%M").time()
+        timezone = context.args[1] if len(context.args) > 1 else DEFAULT_TIMEZONE
+        subscriptions.subscribe(chat_id, BRIEFING, delivery_time, timezone)
+    except (IndexError, ValueError):
+        await context.bot.send_message(
+            chat_id=chat_id,
+            text="Bitte so: /time 06:30 oder /time 06:30 Europe/Berlin"
+        )
+        return
+    await context.bot.send_message(
+        chat_id=chat_id,
+        text=f"⏰ Dein Briefing kommt ab jetzt täglich um {delivery_time.strftime('%H:%M')} Uhr ({timezone})."
+    )
+
+async def stop_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Cancels the daily briefing."""
+    subscriptions.unsubscribe(update.effective_chat.id, BRIEFING)
+    await context.bot.send_message(
+        chat_id=update.effective_chat.id,
+        text="Dein tägliches Briefing ist abbestellt. Mit /start kannst du es wieder aktivieren."
+    )
+
 async def weather_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Sends the weather immediately."""
-    report = get_weather_hamburg()
-    await context.bot.send_message(chat_id=update.effective_chat.id, text=report)
+    chat_id = update.effective_chat.id
+    report = (await get_local_weather([chat_id])).get(chat_id) or await get_weather_hamburg()
+    await context.bot.send_message(chat_id=chat_id, text=report)
 
-async def briefing_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Sends the full daily briefing immediately."""
+async def location_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Stores a shared location for the chat's weather."""
+    location = update.message.location
+    chat_locations.set(update.effective_chat.id, location.latitude, location.longitude)
     await context.bot.send_message(
-        chat_id=update.effective_chat.id, 
-        text="Einen Moment, ich lade deine Daten..."
+        chat_id=update.effective_chat.id,
+        text="📍 Standort gespeichert! Wetter und Briefing kommen ab jetzt für deinen Ort."
     )
-    report = get_daily_briefing()
-    await context.bot.send_message(chat_id=update.effective_chat.id, text=report)
 
-async def send_morning_message(context: ContextTypes.DEFAULT_TYPE):
-    """Callback for the daily job."""
-    chat_id = context.job.data
-    report = get_daily_briefing()
-    await context.bot.send_message(chat_id=chat_id, text=report)
+async def briefing_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Sends the full daily briefing immediately."""
+    chat_id = update.effective_chat.id
+    if briefing_cache.peek(briefing_account()) is None:
+        await context.bot.send_message(
+            chat_id=chat_id, 
+            text="Einen Moment, ich lade deine Daten..."
+        )
+    parts = await get_briefing_parts()
+    local_weather = (await get_local_weather([chat_id])).get(chat_id)
+    await context.bot.send_message(chat_id=chat_id, text=render_briefing(parts, local_weather))
+
+async def send_calendar_view(update: Update, context: ContextTypes.DEFAULT_TYPE, view):
+    """Sends a calendar view; all views share one cached window of events."""
+    email = os.getenv('ICLOUD_EMAIL')
+    password = os.getenv('ICLOUD_PASSWORD')
+    if email and password:
+        text = await asyncio.to_thread(fetch_calendar_view, view, email, password)
+    else:
+        text = "⚠️ iCloud Zugangsdaten fehlen in der .env Datei."
+    await context.bot.send_message(chat_id=update.effective_chat.id, text=text[:MAX_MESSAGE_LENGTH])
+
+async def tomorrow_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Sends tomorrow's calendar events."""
+    await send_calendar_view(update, context, "get_tomorrows_events")
+
+async def week_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Sends the calendar events of the next seven days."""
+    await send_calendar_view(update, context, "get_week_events")
+
+async def send_markdown(bot, chat_id, text, message_id=None):
+    """Sends (or edits into message_id) Gemini Markdown, falling back to plain text."""
+    if message_id:
+        send = lambda **kwargs: bot.edit_message_text(chat_id=chat_id, message_id=message_id, **kwargs)
+    else:
+        send = lambda **kwargs: bot.send_message(chat_id=chat_id, **kwargs)
+    try:
+        await send(text=text, parse_mode="Markdown")
+    except BadRequest as e:
+        if "not modified" in str(e).lower():
+            # A streamed message already shows exactly this text
+            return
+        # Unbalanced Markdown in the reply
+        logging.warning(f"Markdown rejected ({e}), sending plain text")
+        try:
+            await send(text=text)
+        except BadRequest as e:
+            # The streamed plain text already is the final message
+            if "not modified" not in str(e).lower():
+                raise
+
+async def stream_reply(bot, chat_id, chunks):
+    """
+    Shows a streamed reply in one Telegram message, edited at most every
+    STREAM_EDIT_INTERVAL seconds and finalized with Markdown. Returns the full text.
+    """
+    message = None
+    shown = ""
+    last_edit = 0.0
+    reply = ""
+    async for reply in chunks:
+        preview = reply[:MAX_MESSAGE_LENGTH]
+        now = asyncio.get_running_loop().time()
+        if message is None:
+            message = await bot.send_message(chat_id=chat_id, text=preview)
+        elif preview != shown and now - last_edit >= STREAM_EDIT_INTERVAL:
+            await bot.edit_message_text(chat_id=chat_id, message_id=message.message_id, text=preview)
+        else:
+            continue
+        shown = preview
+        last_edit = now
+
+    # Final pass with formatting; overflow goes into follow-up messages
+    parts = [reply[i:i + MAX_MESSAGE_LENGTH] for i in range(0, len(reply), MAX_MESSAGE_LENGTH)]
+    for i, part in enumerate(parts):
+        await send_markdown(bot, chat_id, part, message_id=message.message_id if i == 0 and message else None)
+    return reply
 
 async def handle_ai_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handles user messages by sending them to Gemini."""
@@ -124,69 +324,90 @@ async def handle_ai_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Notify user that we are thinking (optional, but good UX)
     await context.bot.send_chat_action(chat_id=chat_id, action="typing")
     
-    try:
-        # Check if we have an active session
-        if chat_id not in chat_sessions:
-            model = genai.GenerativeModel('gemini-flash-latest')
-            chat_sessions[chat_id] = model.start_chat(history=[])
-        
-        chat = chat_sessions[chat_id]
-        response = chat.send_message(user_text)
-        
-        await context.bot.send_message(
-            chat_id=chat_id,
-            text=response.text,
-            parse_mode="Markdown" # Gemini produces Markdown
-        )
-    except Exception as e:
-        logging.error(f"Gemini Error: {e}")
-        await context.bot.send_message(
-            chat_id=chat_id,
-            text="Entschuldigung, ich habe gerade Schwierigkeiten zu antworten."
-        )
+    # Turns of the same chat are processed in order, other chats keep going
+    async with chat_lock(chat_id):
+        try:
+            await load_genai()
+            # Reuses the active session or starts a new one
+            chat = await chat_sessions.get(chat_id)
+            if GEMINI_STREAMING:
+                reply = await stream_reply(context.bot, chat_id, stream_chat_message(chat, user_text))
+            else:
+                response = await send_chat_message(chat, user_text)
+                reply = response.text
+                await send_markdown(context.bot, chat_id, reply) # Gemini produces Markdown
+            chat_sessions.record(chat_id, user_text, reply)
+        except Exception as e:
+            logging.error(f"Gemini Error: {e}")
+            # A failed or aborted stream leaves the SDK session unusable; rebuild it from the persisted turns
+            chat_sessions.discard(chat_id)
+            await context.bot.send_message(
+                chat_id=chat_id,
+                text="Entschuldigung, ich habe gerade Schwierigkeiten zu antworten."
+            )
 
-async def get_ai_love_message():
-    """Generates a sweet, unique good morning message using Gemini."""
-    try:
-        model = genai.GenerativeModel('gemini-flash-latest')
-        prompt = (
-            "Schreibe eine kurze, liebevolle Guten-Morgen-Nachricht an meine Freundin. "
-            "WICHTIG: Schreibe aus MEINER Perspektive (Ich-Form). "
-            "INHALT: Mischung aus Liebe und Motivation für den Tag. "
-            "Vermeide Kitsch, sei authentisch. "
-            "VERBOTEN: Platzhalter wie '[Dein Name]', '[Datum]' oder ähnliches. Nutze keine Platzhalter! "
-            "Unterschreibe NICHT oder nur mit 'Dein Schatz'. "
-            "Erwähne NIEMALS, dass du eine KI bist. "
-            "Antworte als reinen Text."
-        )
-        response = model.generate_content(prompt)
-        
-        # Cleanup: Remove any HTML-like tags (including blockquote) and quotes
-        text = response.text
-        # Remove HTML tags
-        clean_text = re.sub(r'<[^>]+>', '', text).strip()
-        # Remove surrounding quotes if present
-        if clean_text.startswith('"') and clean_text.endswith('"'):
-            clean_text = clean_text[1:-1]
-            
-        return clean_text
-    except Exception as e:
-        logging.error(f"Love message error: {e}")
-        return "Guten Morgen mein Schatz! ❤️ Ich liebe dich über alles!"
+async def refill_love_pool(context: ContextTypes.DEFAULT_TYPE):
+    """Background job that keeps the love message pool filled."""
+    if not scheduler_lease.is_leader:
+        return
+    await love_pool.refill()
 
-async def send_girlfriend_message(context: ContextTypes.DEFAULT_TYPE):
-    """Callback to send the daily love message."""
-    chat_id = context.job.data
-    message = await get_ai_love_message()
-    await context.bot.send_message(chat_id=chat_id, text=message)
+async def send_love_message(context: ContextTypes.DEFAULT_TYPE, chat_id):
+    """Sends a pooled love message and tops the pool up in the background."""
+    await context.bot.send_message(chat_id=chat_id, text=love_pool.take())
+    context.application.create_task(love_pool.refill())
+
+async def prepare_love_messages(chat_ids):
+    """Love messages share nothing; each chat gets its own pooled message."""
+    return None
+
+def render_love_message(shared, chat_id):
+    return love_pool.take()
+
+love_broadcast = BroadcastScheduler(
+    LOVE,
+    prepare_love_messages,
+    render_love_message,
+    send_kwargs={'rate_limit_args': {'priority': BROADCAST}}
+)
+
+slot_clock = MinuteClock()
+
+async def scheduler_tick(context: ContextTypes.DEFAULT_TYPE):
+    """
+    The only scheduler job: delivers every slot that is due this minute and
+    pre-builds the briefing BRIEFING_WARMUP_MINUTES before a briefing slot.
+    """
+    if not scheduler_lease.is_leader:
+        return
+    minutes = slot_clock.advance()
+    for minute in minutes:
+        for broadcast in (morning_broadcast, love_broadcast):
+            chat_ids = subscriptions.due(broadcast.kind, minute)
+            if chat_ids:
+                context.application.create_task(broadcast.deliver(context.bot, chat_ids))
+        if subscriptions.due(LOVE, minute):
+            context.application.create_task(love_pool.refill())
+        if subscriptions.due(BRIEFING, minute + datetime.timedelta(minutes=BRIEFING_WARMUP_MINUTES)):
+            context.application.create_task(warm_briefing())
+    if minutes:
+        scheduler_lease.save_progress(minutes[-1].timestamp())
+
+async def renew_scheduler_lease(context: ContextTypes.DEFAULT_TYPE):
+    """Keeps or takes over the scheduler lease, so scheduled messages are sent by one instance only."""
+    was_leader = scheduler_lease.is_leader
+    # Runs without awaiting, so no scheduler tick sees the new leadership before the clock is resumed
+    if scheduler_lease.try_acquire() and not was_leader:
+        # Continue where the previous leader stopped, so no slot is sent twice or skipped
+        progress = scheduler_lease.progress()
+        if progress:
+            slot_clock.resume(datetime.datetime.fromtimestamp(progress, datetime.timezone.utc))
 
 async def love_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Sends a love message immediately."""
     # Only allowed for girlfriend or owner (optional security, but good practice)
     # For now, open to use.
-    await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
-    message = await get_ai_love_message()
-    await context.bot.send_message(chat_id=update.effective_chat.id, text=message)
+    await send_love_message(context, update.effective_chat.id)
 
 async def id_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Returns the chat ID."""
@@ -212,7 +433,8 @@ async def debug_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
 
-    calendars = list_available_calendars(email, password)
+    from calendar_utils import list_available_calendars
+    calendars = await asyncio.to_thread(list_available_calendars, email, password)
     
     cal_list_str = "\n".join([f"- {c}" for c in calendars])
     report = (
@@ -228,48 +450,199 @@ async def debug_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         parse_mode="Markdown"
     )
 
-if __name__ == '__main__':
-    token = os.getenv('TELEGRAM_BOT_TOKEN')
-    if not token:
-        print("Error: TELEGRAM_BOT_TOKEN not found in .env file.")
-        exit(1)
+# Chat allowed to run admin commands like /profile
+ADMIN_CHAT_ID = os.getenv('ADMIN_CHAT_ID')
+# Token for the /debug/profile endpoint of the web server; the endpoint is off without it
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN')
 
-    application = ApplicationBuilder().token(token).build()
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Captures a CPU and memory profile of the running bot (admin only)."""
+    chat_id = update.effective_chat.id
+    if not ADMIN_CHAT_ID or str(chat_id) != ADMIN_CHAT_ID:
+        await context.bot.send_message(chat_id=chat_id, text="⛔ Dieser Befehl ist nur für Admins.")
+        return
+
+    from profiling import profiler, ProfileBusy
+    try:
+        seconds = float(context.args[0]) if context.args else 30
+    except ValueError:
+        await context.bot.send_message(chat_id=chat_id, text="Nutzung: /profile [Sekunden]")
+        return
+    seconds = max(1.0, min(seconds, profiler.max_seconds))
+
+    await context.bot.send_message(chat_id=chat_id, text=f"⏱️ Profiliere {seconds:.0f} Sekunden...")
+    try:
+        report = await profiler.capture(seconds)
+    except ProfileBusy:
+        await context.bot.send_message(chat_id=chat_id, text="⚠️ Es läuft bereits eine Profilierung.")
+        return
+    # The report is usually longer than one message
+    await context.bot.send_document(
+        chat_id=chat_id,
+        document=report.encode(),
+        filename=f"profile-{datetime.datetime.now():%Y%m%d-%H%M%S}.txt",
+        caption="📊 Profil fertig"
+    )
+
+# "polling" for local runs, "webhook" behind a public URL (e.g. Render)
+BOT_MODE = os.getenv('BOT_MODE', "polling").lower()
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', "").rstrip("/")
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', "/telegram")
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+
+# Serves Render's health checks and, in webhook mode, Telegram's updates
+keep_alive_server = KeepAliveServer()
+if PROFILE_TOKEN:
+    keep_alive_server.add_profiler(PROFILE_TOKEN)
+
+async def post_init(application):
+    """Starts the web server on the bot's event loop."""
+    await keep_alive_server.start()
+    # Settle leadership before the job queue starts ticking
+    await renew_scheduler_lease(None)
+    startup.mark("ready")
+
+async def record_first_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Runs after the regular handlers; completes the startup report on the first update."""
+    if any(milestone == "first update" for milestone, _ in startup.milestones):
+        return
+    startup.mark("first update")
+    logging.info(f"Startup: {startup.report()}")
+
+async def post_shutdown(application):
+    """Stops the web server, hands the scheduler over, flushes the chat history and closes pooled HTTP clients when the bot stops."""
+    await keep_alive_server.stop()
+    if scheduler_lease is not None and scheduler_lease.is_leader:
+        scheduler_lease.release()
+    if chat_sessions is not None and chat_sessions.history_db is not None:
+        await asyncio.to_thread(chat_sessions.history_db.close)
+    await weather_provider.aclose()
+
+async def run_webhook(application):
+    """Runs the bot with updates pushed by Telegram to the web server."""
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            # Not available on Windows
+            pass
+
+    keep_alive_server.add_webhook(application, WEBHOOK_PATH, WEBHOOK_SECRET)
+    async with application:
+        await post_init(application)
+        try:
+            await application.bot.set_webhook(
+                url=WEBHOOK_URL + WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=Update.ALL_TYPES,
+            )
+            await application.start()
+            print(f"Webhook set to {WEBHOOK_URL + WEBHOOK_PATH}")
+            await stop_event.wait()
+            await application.stop()
+        finally:
+            await post_shutdown(application)
+
+def create_application(token, base_url=None):
+    """Builds the bot: opens the local state and registers handlers and background jobs."""
+    init_state()
+    startup.mark("state loaded")
+
+    builder = (
+        ApplicationBuilder()
+        .token(token)
+        # Handle updates concurrently so a slow Gemini reply does not stall other chats
+        .concurrent_updates(True)
+        # All outgoing messages pass one prioritized, rate-limited queue
+        .rate_limiter(PriorityRateLimiter())
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    if base_url:
+        builder = builder.base_url(base_url)
+    application = builder.build()
     job_queue = application.job_queue
 
     # Schedule Girlfriend Message if ID is present
     gf_id = os.getenv('GIRLFRIEND_CHAT_ID')
-    if gf_id:
+    if gf_id and subscriptions.get(int(gf_id), LOVE) is None:
         print(f"Scheduling love messages for ID: {gf_id}")
-        # Remove existing jobs for her to avoid duplicates on restart
-        for job in job_queue.get_jobs_by_name("girlfriend_love"):
-            job.schedule_removal()
-            
-        job_queue.run_daily(
-            send_girlfriend_message,
-            time=datetime.time(hour=7, minute=0), # 7:00 AM
-            chat_id=int(gf_id),
-            name="girlfriend_love",
-            data=int(gf_id)
-        )
+        subscriptions.subscribe(int(gf_id), LOVE)
+
+    # Keep (or take over) the scheduler lease; it is first taken in post_init
+    job_queue.run_repeating(renew_scheduler_lease, interval=LEADER_LEASE_SECONDS / 3, name="scheduler_lease")
+
+    # One ticking job for all subscriptions, aligned to the start of each minute
+    now = datetime.datetime.now()
+    job_queue.run_repeating(scheduler_tick, interval=60, first=61 - now.second, name="scheduler")
+
+    # Keep the cached briefing fresh during the day (on every instance, /briefing is served locally)
+    job_queue.run_repeating(
+        warm_briefing_cache, interval=BRIEFING_REFRESH_MINUTES * 60, first=5, name="briefing_refresh"
+    )
+
+    # Fill the love message pool shortly after start and check it hourly (overnight included)
+    job_queue.run_repeating(refill_love_pool, interval=3600, first=10, name="love_pool_refill")
 
     start_handler = CommandHandler('start', start)
+    time_handler = CommandHandler('time', time_command)
+    stop_handler = CommandHandler('stop', stop_command)
     weather_handler = CommandHandler('weather', weather_command)
     briefing_handler = CommandHandler('briefing', briefing_command)
+    tomorrow_handler = CommandHandler('tomorrow', tomorrow_command)
+    week_handler = CommandHandler('week', week_command)
     id_handler = CommandHandler('id', id_command)
     love_handler = CommandHandler('love', love_command)
     debug_handler = CommandHandler('debug', debug_command)
+    profile_handler = CommandHandler('profile', profile_command)
+    # Only new messages: live locations also send edited_message updates every few seconds
+    location_handler = MessageHandler(filters.UpdateType.MESSAGE & filters.LOCATION, location_message)
     
     # Replaces Echo with AI
     ai_handler = MessageHandler(filters.TEXT & (~filters.COMMAND), handle_ai_message)
     
     application.add_handler(start_handler)
+    application.add_handler(time_handler)
+    application.add_handler(stop_handler)
     application.add_handler(weather_handler)
     application.add_handler(briefing_handler)
+    application.add_handler(tomorrow_handler)
+    application.add_handler(week_handler)
     application.add_handler(id_handler)
     application.add_handler(love_handler)
     application.add_handler(debug_handler)
+    application.add_handler(profile_handler)
+    application.add_handler(location_handler)
     application.add_handler(ai_handler)
+    # A later group, so it sees the update after it was handled
+    application.add_handler(TypeHandler(Update, record_first_update), group=1)
+    return application
+
+def main():
+    # Enable logging
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    startup.mark("imports")
+
+    token = os.getenv('TELEGRAM_BOT_TOKEN')
+    if not token:
+        print("Error: TELEGRAM_BOT_TOKEN not found in .env file.")
+        exit(1)
+
+    application = create_application(token)
     
     print("Bot is successfully running...")
-    application.run_polling()
+    if BOT_MODE == "webhook":
+        if not WEBHOOK_URL:
+            print("Error: WEBHOOK_URL is required when BOT_MODE=webhook.")
+            exit(1)
+        asyncio.run(run_webhook(application))
+    else:
+        application.run_polling()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+import threading
+import time
+
+# Latency buckets in seconds, from fast cache-backed calls up to slow CalDAV discovery
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_registry = []
+_lock = threading.Lock()
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter with labels, Prometheus style."""
+
+    type = "counter"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with _lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+
+class Gauge:
+    """Value that can go up and down, with labels, Prometheus style."""
+
+    type = "gauge"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        _registry.append(self)
+
+    def set(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with _lock:
+            self._values[key] = value
+
+    def samples(self):
+        with _lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+
+class Histogram:
+    """Cumulative latency histogram with labels, Prometheus style."""
+
+    type = "histogram"
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        # labels -> [bucket counts..., sum, count]
+        self._values = {}
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with _lock:
+            values = self._values.get(key)
+            if values is None:
+                values = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    values[i] += 1
+            values[-2] += value
+            values[-1] += 1
+
+    def samples(self):
+        with _lock:
+            items = [(key, list(values)) for key, values in self._values.items()]
+        samples = []
+        for key, values in items:
+            for bound, count in zip(self.buckets + (float("inf"),), values[:len(self.buckets)] + [values[-1]]):
+                samples.append((f"{self.name}_bucket", key + (("le", _format_value(bound)),), count))
+            samples.append((f"{self.name}_sum", key, values[-2]))
+            samples.append((f"{self.name}_count", key, values[-1]))
+        return samples
+
+
+def render():
+    """Returns all metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in _registry:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        for name, labels, value in metric.samples():
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+dependency_latency = Histogram(
+    "bot_dependency_latency_seconds", "Latency of calls to external services."
+)
+dependency_requests = Counter(
+    "bot_dependency_requests_total", "Calls to external services by outcome."
+)
+telegram_queue_wait = Histogram(
+    "bot_telegram_queue_wait_seconds", "Time outgoing messages wait for a rate limit permit."
+)
+broadcast_duration = Histogram(
+    "bot_broadcast_duration_seconds", "Time to deliver one scheduled broadcast to all due chats.",
+    buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+)
+broadcast_messages = Counter(
+    "bot_broadcast_messages_total", "Scheduled messages by outcome."
+)
+startup_seconds = Gauge(
+    "bot_startup_seconds", "Seconds from process start to each startup milestone."
+)
+
+
+class StartupTimer:
+    """Records named startup milestones, in seconds since `started`."""
+
+    def __init__(self, started=None):
+        self.started = time.perf_counter() if started is None else started
+        self.milestones = []
+
+    def mark(self, milestone):
+        elapsed = time.perf_counter() - self.started
+        self.milestones.append((milestone, elapsed))
+        startup_seconds.set(round(elapsed, 4), milestone=milestone)
+        return elapsed
+
+    def report(self):
+        return ", ".join(f"{milestone} {elapsed:.2f}s" for milestone, elapsed in self.milestones)
+
+
+class timed:
+    """
+    Times a call to an external service, as a sync or async context manager:
+
+        with timed("caldav", "discovery"):
+            ...
+
+    Records the latency histogram and counts the call as "ok" or "error".
+    """
+
+    def __init__(self, dependency, operation):
+        self.labels = {"dependency": dependency, "operation": operation}
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        dependency_latency.observe(time.perf_counter() - self.started, **self.labels)
+        dependency_requests.inc(outcome="error" if exc_type else "ok", **self.labels)
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return self.__exit__(exc_type, exc, tb)
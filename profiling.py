@@ -0,0 +1,96 @@
+import os
+import asyncio
+import cProfile
+import pstats
+import logging
+import tracemalloc
+
+# Longest capture an admin may request, in seconds
+PROFILE_MAX_SECONDS = float(os.getenv('PROFILE_MAX_SECONDS', 120))
+# Frames kept per allocation, so sites show the caller rather than just the allocator
+TRACEMALLOC_FRAMES = int(os.getenv('TRACEMALLOC_FRAMES', 5))
+
+
+class ProfileBusy(Exception):
+    """Raised when a capture is requested while another one is running."""
+
+
+class Profiler:
+    """
+    Time-boxed CPU and memory capture of the running bot, on demand.
+
+    Nothing is installed while idle: cProfile and tracemalloc are only switched
+    on for the requested window and switched off again afterwards. The CPU
+    profile is taken on the event loop thread, where the handlers and jobs run;
+    work handed to asyncio.to_thread (CalDAV, calendar parsing) may only show
+    up as the time the loop spends awaiting it. The memory part reports what was
+    allocated during the window and is still alive at its end.
+    """
+
+    def __init__(self, max_seconds=PROFILE_MAX_SECONDS, frames=TRACEMALLOC_FRAMES):
+        self.max_seconds = max_seconds
+        self.frames = frames
+        self._lock = asyncio.Lock()
+
+    @property
+    def busy(self):
+        return self._lock.locked()
+
+    async def capture(self, seconds, limit=15):
+        """Profiles the process for `seconds` and returns a plain text report."""
+        if self.busy:
+            raise ProfileBusy()
+        seconds = max(1.0, min(float(seconds), self.max_seconds))
+        async with self._lock:
+            logging.info(f"Profiling for {seconds:.0f}s")
+            started_tracing = not tracemalloc.is_tracing()
+            if started_tracing:
+                tracemalloc.start(self.frames)
+            before = tracemalloc.take_snapshot()
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                profile.disable()
+                after = tracemalloc.take_snapshot()
+                current, peak = tracemalloc.get_traced_memory()
+                if started_tracing:
+                    tracemalloc.stop()
+
+        return "\n\n".join([
+            f"Profil über {seconds:.0f}s",
+            self._cpu_report(profile, limit),
+            self._memory_report(before, after, current, peak, limit),
+        ])
+
+    def _cpu_report(self, profile, limit):
+        stats = pstats.Stats(profile)
+        lines = ["CPU (kumulativ, Sekunden):"]
+        # stats.stats: (file, line, function) -> (primitive calls, calls, own time, cumulative time, callers)
+        rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)
+        for (filename, line, function), (_, calls, own, cumulative, _) in rows[:limit]:
+            location = f"{os.path.basename(filename)}:{line}" if line else filename
+            lines.append(f"{cumulative:8.3f} {own:8.3f} {calls:>7} {function} ({location})")
+        return "\n".join(lines)
+
+    def _memory_report(self, before, after, current, peak, limit):
+        filters = [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ]
+        before = before.filter_traces(filters)
+        after = after.filter_traces(filters)
+        lines = [f"Speicher (verfolgt {current / 1024:.0f} KiB, Spitze {peak / 1024:.0f} KiB), Zuwachs nach Stelle:"]
+        for stat in after.compare_to(before, "lineno")[:limit]:
+            if stat.size_diff <= 0:
+                break
+            frame = stat.traceback[0]
+            lines.append(
+                f"{stat.size_diff / 1024:+9.1f} KiB {stat.count_diff:+7} "
+                f"{os.path.basename(frame.filename)}:{frame.lineno}"
+            )
+        return "\n".join(lines)
+
+
+profiler = Profiler()
@@ -0,0 +1,162 @@
+import os
+import asyncio
+import logging
+import time
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from metrics import timed, telegram_queue_wait
+
+# Priority classes, lower is served first. Pass as rate_limit_args={'priority': ...}
+INTERACTIVE = 0
+BROADCAST = 1
+
+# Telegram allows about 30 messages per second per bot ...
+GLOBAL_RATE = float(os.getenv('TELEGRAM_GLOBAL_RATE', 30))
+# ... about one per second per private chat and 20 per minute per group
+PRIVATE_CHAT_RATE = float(os.getenv('TELEGRAM_CHAT_RATE', 1))
+GROUP_CHAT_RATE = 20 / 60
+# How often a request is retried after a RetryAfter error
+MAX_RETRIES = int(os.getenv('TELEGRAM_MAX_RETRIES', 3))
+
+# Endpoints that count against the message limits; everything else is not throttled
+THROTTLED_ENDPOINTS = {
+    "sendMessage", "editMessageText", "sendPhoto", "sendDocument", "sendSticker",
+    "sendLocation", "forwardMessage", "copyMessage",
+}
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, bursts up to `capacity`."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self):
+        """Seconds until one token is available (0 if it is available now)."""
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self._refill()
+        self.tokens -= 1
+
+    def full(self):
+        self._refill()
+        return self.tokens >= self.capacity
+
+
+class PriorityRateLimiter(BaseRateLimiter):
+    """
+    Central outbound queue for all Bot API message requests.
+
+    Requests wait for a permit that is handed out in priority order
+    (INTERACTIVE before BROADCAST, FIFO within a class) while respecting a
+    global and a per-chat token bucket. A chat that is over its limit does not
+    hold up other chats. On RetryAfter all sending pauses for the requested
+    time and the request is queued again.
+    """
+
+    def __init__(self, global_rate=GLOBAL_RATE, chat_rate=PRIVATE_CHAT_RATE, max_retries=MAX_RETRIES):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.max_retries = max_retries
+        self._chat_buckets = {}
+        self._queue = None
+        self._dispatcher = None
+        self._paused_until = 0.0
+        self._seq = 0
+
+    async def initialize(self):
+        # Application and Updater both initialize the bot; start only one dispatcher
+        if self._dispatcher is not None:
+            return
+        self._queue = asyncio.PriorityQueue()
+        self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def shutdown(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+            self._dispatcher = None
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) > 10000:
+                # Forget chats that have been quiet long enough to be full again
+                self._chat_buckets = {key: b for key, b in self._chat_buckets.items() if not b.full()}
+            is_group = (isinstance(chat_id, int) and chat_id < 0) or str(chat_id).startswith("@")
+            rate = GROUP_CHAT_RATE if is_group else self.chat_rate
+            bucket = TokenBucket(rate, max(1, rate * 3))
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self._queue.get()
+            priority, seq, chat_id, future = item
+            if future.done():
+                continue
+
+            pause = self._paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+
+            if chat_id is not None:
+                chat_wait = self._chat_bucket(chat_id).wait_time()
+                if chat_wait > 0:
+                    # Put it back once the chat has a token again; other chats go on
+                    loop.call_later(chat_wait, self._queue.put_nowait, item)
+                    continue
+
+            global_wait = self.global_bucket.wait_time()
+            if global_wait > 0:
+                await asyncio.sleep(global_wait)
+            self.global_bucket.consume()
+            if chat_id is not None:
+                self._chat_bucket(chat_id).consume()
+            future.set_result(None)
+
+    async def _acquire(self, chat_id, priority):
+        future = asyncio.get_running_loop().create_future()
+        self._seq += 1
+        self._queue.put_nowait((priority, self._seq, chat_id, future))
+        await future
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if endpoint not in THROTTLED_ENDPOINTS or self._queue is None:
+            return await callback(*args, **kwargs)
+
+        priority = (rate_limit_args or {}).get('priority', INTERACTIVE)
+        chat_id = data.get("chat_id")
+        for attempt in range(self.max_retries + 1):
+            queued_at = time.monotonic()
+            await self._acquire(chat_id, priority)
+            telegram_queue_wait.observe(time.monotonic() - queued_at, priority=priority)
+            try:
+                with timed("telegram", endpoint):
+                    return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                retry_after = e.retry_after
+                if isinstance(retry_after, (int, float)):
+                    seconds = retry_after
+                else:
+                    seconds = retry_after.total_seconds()
+                if attempt == self.max_retries:
+                    raise
+                logging.warning(f"Telegram flood limit hit on {endpoint}, pausing {seconds}s")
+                self._paused_until = max(self._paused_until, time.monotonic() + seconds)
@@ -0,0 +1,12 @@
+import os
+import sqlite3
+
+# All persistent bot state lives in this SQLite file
+DB_PATH = os.getenv('BOT_DB_PATH', "bot_data.sqlite3")
+
+def connect(path=None):
+    """Opens a connection to the bot database that may be shared between threads."""
+    conn = sqlite3.connect(path or DB_PATH, check_same_thread=False, timeout=10)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
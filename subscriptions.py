@@ -0,0 +1,133 @@
+import os
+import datetime
+import logging
+import threading
+from collections import defaultdict, Counter
+
+from dateutil import tz
+
+import storage
+
+# Subscription kinds
+BRIEFING = "briefing"
+LOVE = "love"
+
+DEFAULT_TIMEZONE = os.getenv('DEFAULT_TIMEZONE', "Europe/Berlin")
+DEFAULT_DELIVERY_TIME = datetime.time(hour=7, minute=0)
+
+
+class SubscriptionRegistry:
+    """
+    Persistent registry of scheduled deliveries.
+
+    Every subscription has a local delivery time and a timezone. The whole
+    table is loaded with one query at startup into an index keyed by
+    (kind, timezone, hour, minute), so finding the chats due in a given minute
+    costs one lookup per distinct timezone, independent of the subscriber count.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS subscriptions (
+        chat_id INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        hour INTEGER NOT NULL,
+        minute INTEGER NOT NULL,
+        timezone TEXT NOT NULL,
+        PRIMARY KEY (chat_id, kind)
+    );
+    """
+
+    def __init__(self, path=None):
+        self._conn = storage.connect(path)
+        self._conn.executescript(self.SCHEMA)
+        self._lock = threading.Lock()
+        # (kind, timezone, hour, minute) -> set of chat_ids
+        self._slots = defaultdict(set)
+        # (chat_id, kind) -> slot key
+        self._by_chat = {}
+        # kind -> Counter of timezones in use
+        self._timezones = defaultdict(Counter)
+        self._load()
+
+    def _load(self):
+        rows = self._conn.execute("SELECT chat_id, kind, hour, minute, timezone FROM subscriptions").fetchall()
+        for chat_id, kind, hour, minute, timezone in rows:
+            self._index(chat_id, (kind, timezone, hour, minute))
+        logging.info(f"Loaded {len(rows)} subscriptions")
+
+    def _index(self, chat_id, key):
+        self._slots[key].add(chat_id)
+        self._by_chat[(chat_id, key[0])] = key
+        self._timezones[key[0]][key[1]] += 1
+
+    def _unindex(self, chat_id, kind):
+        key = self._by_chat.pop((chat_id, kind), None)
+        if key is None:
+            return
+        self._slots[key].discard(chat_id)
+        if not self._slots[key]:
+            del self._slots[key]
+        self._timezones[kind][key[1]] -= 1
+        if not self._timezones[kind][key[1]]:
+            del self._timezones[kind][key[1]]
+
+    def get(self, chat_id, kind):
+        """Returns (delivery time, timezone) of a subscription, or None."""
+        key = self._by_chat.get((chat_id, kind))
+        if key is None:
+            return None
+        return datetime.time(hour=key[2], minute=key[3]), key[1]
+
+    def subscribe(self, chat_id, kind, delivery_time=DEFAULT_DELIVERY_TIME, timezone=DEFAULT_TIMEZONE):
+        """Creates or moves a subscription."""
+        if tz.gettz(timezone) is None:
+            raise ValueError(f"Unknown timezone: {timezone}")
+        key = (kind, timezone, delivery_time.hour, delivery_time.minute)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO subscriptions (chat_id, kind, hour, minute, timezone) VALUES (?, ?, ?, ?, ?)",
+                (chat_id, kind, delivery_time.hour, delivery_time.minute, timezone)
+            )
+            self._unindex(chat_id, kind)
+            self._index(chat_id, key)
+
+    def unsubscribe(self, chat_id, kind):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM subscriptions WHERE chat_id = ? AND kind = ?", (chat_id, kind))
+            self._unindex(chat_id, kind)
+
+    def due(self, kind, minute):
+        """Returns the chat_ids of `kind` whose local delivery time is the given (aware) minute."""
+        chat_ids = []
+        for timezone in list(self._timezones[kind]):
+            local = minute.astimezone(tz.gettz(timezone))
+            chat_ids.extend(self._slots.get((kind, timezone, local.hour, local.minute), ()))
+        return chat_ids
+
+
+class MinuteClock:
+    """
+    Turns a roughly once-a-minute tick into the exact list of minutes to
+    process, so a late or skipped tick does not skip deliveries.
+    """
+
+    def __init__(self, max_catch_up=10):
+        self.max_catch_up = max_catch_up
+        self._last = None
+
+    def resume(self, last):
+        """Continues after `last`, the last minute processed (e.g. by a previous instance)."""
+        self._last = last.replace(second=0, microsecond=0)
+
+    def advance(self, now=None):
+        now = (now or datetime.datetime.now(datetime.timezone.utc)).replace(second=0, microsecond=0)
+        if self._last is None:
+            self._last = now - datetime.timedelta(minutes=1)
+        earliest = now - datetime.timedelta(minutes=self.max_catch_up - 1)
+        minute = max(self._last + datetime.timedelta(minutes=1), earliest)
+        minutes = []
+        while minute <= now:
+            minutes.append(minute)
+            minute += datetime.timedelta(minutes=1)
+        self._last = max(self._last, now)
+        return minutes
@@ -0,0 +1,231 @@
+import datetime
+
+import pytest
+from dateutil import tz
+
+from calendar_mirror import CalendarMirror, EventWindow, index_resource, _expand
+
+BERLIN = tz.gettz("Europe/Berlin")
+ACCOUNT = "test@example.com"
+CALENDAR = "/calendars/home/"
+# A Monday
+DAY = datetime.date(2026, 10, 19)
+
+
+def vcalendar(*events):
+    body = "".join(f"BEGIN:VEVENT\r\n{event.strip()}\r\nEND:VEVENT\r\n" for event in events)
+    return f"BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//Test//EN\r\n{body}END:VCALENDAR\r\n"
+
+
+@pytest.fixture
+def mirror(tmp_path):
+    return CalendarMirror(path=str(tmp_path / "mirror.sqlite3"))
+
+
+def store(mirror, **resources):
+    """Replaces the test calendar with the given {href: ical} resources."""
+    changed = {href: index_resource(ical) for href, ical in resources.items()}
+    mirror._apply(ACCOUNT, CALENDAR, "Home", "token-1", changed, [], full=True)
+
+
+def events_on(mirror, day=DAY):
+    return mirror.window(ACCOUNT, day, 1, "Europe/Berlin").events_on(day)
+
+
+# index_resource
+
+def test_index_resource_reads_timed_event():
+    rows = index_resource(vcalendar(
+        "UID:a\r\nSUMMARY:Arzt\\, Zahn\r\n"
+        "DTSTART;TZID=Europe/Berlin:20261019T090000\r\nDTEND;TZID=Europe/Berlin:20261019T100000"
+    ))
+    assert rows == [{
+        'uid': "a", 'recurrence_id': "", 'summary': "Arzt, Zahn",
+        'dtstart': "2026-10-19T09:00:00", 'dtend': "2026-10-19T10:00:00", 'tzid': "Europe/Berlin",
+        'all_day': False, 'rrule': "", 'exdates': "",
+    }]
+
+
+def test_index_resource_unfolds_lines_and_skips_alarms():
+    rows = index_resource(vcalendar(
+        "UID:a\r\nSUMMARY:Sehr langer\r\n  Titel\r\nDTSTART;VALUE=DATE:20261019\r\n"
+        "BEGIN:VALARM\r\nACTION:DISPLAY\r\nSUMMARY:Erinnerung\r\nEND:VALARM"
+    ))
+    assert len(rows) == 1
+    assert rows[0]['summary'] == "Sehr langer Titel"
+    assert rows[0]['dtstart'] == "2026-10-19"
+    assert rows[0]['all_day'] is True
+
+
+def test_index_resource_converts_exdates_and_recurrence_id_to_start_zone():
+    rows = index_resource(vcalendar(
+        "UID:a\r\nSUMMARY:Weekly\r\nDTSTART;TZID=Europe/Berlin:20261005T090000\r\nRRULE:FREQ=WEEKLY\r\n"
+        "EXDATE:20261012T070000Z,20261026T080000Z",
+        "UID:a\r\nSUMMARY:Moved\r\nRECURRENCE-ID:20261019T070000Z\r\n"
+        "DTSTART;TZID=Europe/Berlin:20261019T110000"
+    ))
+    assert rows[0]['exdates'] == "2026-10-12T09:00:00,2026-10-26T09:00:00"
+    assert rows[1]['recurrence_id'] == "2026-10-19T09:00:00"
+
+
+def test_index_resource_floating_and_utc_times():
+    rows = index_resource(vcalendar(
+        "UID:a\r\nSUMMARY:Floating\r\nDTSTART:20261019T090000",
+        "UID:b\r\nSUMMARY:UTC\r\nDTSTART:20261019T090000Z",
+        "UID:c\r\nSUMMARY:Windows\r\nDTSTART;TZID=W. Europe Standard Time:20261019T090000",
+    ))
+    assert [row['tzid'] for row in rows] == ["", "UTC", ""]
+
+
+# _expand
+
+def test_expand_until_date_with_aware_start():
+    base = datetime.datetime(2026, 10, 5, 9, tzinfo=BERLIN)
+    window = (datetime.datetime(2026, 10, 1, tzinfo=BERLIN), datetime.datetime(2026, 11, 30, tzinfo=BERLIN))
+    instances = _expand("FREQ=WEEKLY;UNTIL=20261019", base, window)
+    assert [instance.day for instance in instances] == [5, 12, 19]
+
+
+def test_expand_utc_until_with_floating_start():
+    base = datetime.datetime(2026, 10, 5, 9)
+    window = (datetime.datetime(2026, 10, 1), datetime.datetime(2026, 11, 30))
+    instances = _expand("FREQ=WEEKLY;UNTIL=20261012T090000Z", base, window)
+    assert [instance.day for instance in instances] == [5, 12]
+
+
+def test_expand_fast_forwards_old_birthdays():
+    base = datetime.datetime(1980, 10, 19)
+    window = (datetime.datetime(2026, 10, 18, 22), datetime.datetime(2026, 10, 20, 2))
+    assert _expand("FREQ=YEARLY", base, window) == [datetime.datetime(2026, 10, 19)]
+
+
+def test_expand_keeps_interval_rules_in_step():
+    base = datetime.datetime(2023, 10, 19)
+    window = (datetime.datetime(2026, 1, 1), datetime.datetime(2027, 12, 31))
+    assert _expand("FREQ=YEARLY;INTERVAL=2", base, window) == [datetime.datetime(2027, 10, 19)]
+
+
+# occurrences via the event window
+
+def test_single_events_in_their_zones(mirror):
+    store(mirror, **{
+        "berlin.ics": vcalendar("UID:a\r\nSUMMARY:Berlin\r\nDTSTART;TZID=Europe/Berlin:20261019T090000"),
+        "utc.ics": vcalendar("UID:b\r\nSUMMARY:UTC\r\nDTSTART:20261019T090000Z"),
+        "floating.ics": vcalendar("UID:c\r\nSUMMARY:Floating\r\nDTSTART:20261019T073000"),
+        "allday.ics": vcalendar("UID:d\r\nSUMMARY:Urlaub\r\nDTSTART;VALUE=DATE:20261019"),
+        "tomorrow.ics": vcalendar("UID:e\r\nSUMMARY:Morgen\r\nDTSTART;VALUE=DATE:20261020"),
+    })
+    # Floating times are local to the queried zone
+    assert events_on(mirror) == ["• 07:30: Floating", "• 09:00: Berlin", "• 11:00: UTC", "• Ganztägig: Urlaub"]
+
+
+def test_utc_event_counts_on_local_date(mirror):
+    store(mirror, **{"late.ics": vcalendar("UID:a\r\nSUMMARY:Spät\r\nDTSTART:20261018T223000Z")})
+    assert events_on(mirror) == ["• 00:30: Spät"]
+    assert events_on(mirror, DAY - datetime.timedelta(days=1)) == []
+
+
+def test_weekly_event_with_exdate(mirror):
+    store(mirror, **{"weekly.ics": vcalendar(
+        "UID:a\r\nSUMMARY:Weekly\r\nDTSTART;TZID=Europe/Berlin:20261005T090000\r\nRRULE:FREQ=WEEKLY\r\n"
+        "EXDATE;TZID=Europe/Berlin:20261019T090000"
+    )})
+    assert events_on(mirror) == []
+    assert events_on(mirror, DAY + datetime.timedelta(days=7)) == ["• 09:00: Weekly"]
+
+
+def test_weekly_event_ended_by_until(mirror):
+    store(mirror, **{"weekly.ics": vcalendar(
+        "UID:a\r\nSUMMARY:Weekly\r\nDTSTART;TZID=Europe/Berlin:20260907T090000\r\n"
+        "RRULE:FREQ=WEEKLY;UNTIL=20261012T070000Z"
+    )})
+    assert events_on(mirror, DAY - datetime.timedelta(days=7)) == ["• 09:00: Weekly"]
+    assert events_on(mirror) == []
+
+
+def test_yearly_all_day_birthday(mirror):
+    store(mirror, **{"birthday.ics": vcalendar(
+        "UID:a\r\nSUMMARY:Geburtstag\r\nDTSTART;VALUE=DATE:19801019\r\nRRULE:FREQ=YEARLY"
+    )})
+    assert events_on(mirror) == ["• Ganztägig: Geburtstag"]
+    assert events_on(mirror, DAY + datetime.timedelta(days=1)) == []
+
+
+def test_override_within_window_replaces_instance(mirror):
+    store(mirror, **{"weekly.ics": vcalendar(
+        "UID:a\r\nSUMMARY:Weekly\r\nDTSTART;TZID=Europe/Berlin:20261005T090000\r\nRRULE:FREQ=WEEKLY",
+        "UID:a\r\nSUMMARY:Weekly (verschoben)\r\nRECURRENCE-ID;TZID=Europe/Berlin:20261019T090000\r\n"
+        "DTSTART;TZID=Europe/Berlin:20261019T140000",
+    )})
+    assert events_on(mirror) == ["• 14:00: Weekly (verschoben)"]
+
+
+def test_override_moved_out_of_window_hides_instance(mirror):
+    store(mirror, **{"weekly.ics": vcalendar(
+        "UID:a\r\nSUMMARY:Weekly\r\nDTSTART;TZID=Europe/Berlin:20261005T090000\r\nRRULE:FREQ=WEEKLY",
+        "UID:a\r\nSUMMARY:Weekly\r\nRECURRENCE-ID;TZID=Europe/Berlin:20261019T090000\r\n"
+        "DTSTART;TZID=Europe/Berlin:20261118T090000",
+    )})
+    assert events_on(mirror) == []
+    assert events_on(mirror, datetime.date(2026, 11, 18)) == ["• 09:00: Weekly"]
+
+
+def test_override_moved_into_window_from_another_day(mirror):
+    store(mirror, **{"weekly.ics": vcalendar(
+        "UID:a\r\nSUMMARY:Weekly\r\nDTSTART;TZID=Europe/Berlin:20261006T090000\r\nRRULE:FREQ=WEEKLY",
+        "UID:a\r\nSUMMARY:Weekly\r\nRECURRENCE-ID;TZID=Europe/Berlin:20261020T090000\r\n"
+        "DTSTART;TZID=Europe/Berlin:20261019T080000",
+    )})
+    assert events_on(mirror) == ["• 08:00: Weekly"]
+    assert events_on(mirror, DAY + datetime.timedelta(days=1)) == []
+
+
+def test_window_is_rebuilt_after_changes(mirror):
+    store(mirror, **{"a.ics": vcalendar("UID:a\r\nSUMMARY:Alt\r\nDTSTART;TZID=Europe/Berlin:20261019T090000")})
+    assert events_on(mirror) == ["• 09:00: Alt"]
+    store(mirror, **{"a.ics": vcalendar("UID:a\r\nSUMMARY:Neu\r\nDTSTART;TZID=Europe/Berlin:20261019T090000")})
+    assert events_on(mirror) == ["• 09:00: Neu"]
+
+
+def test_event_window_deduplicates_and_splits_by_date():
+    occurrences = [
+        (datetime.datetime(2026, 10, 19, 9, tzinfo=BERLIN), "Termin"),
+        (datetime.datetime(2026, 10, 19, 9, tzinfo=BERLIN), "Termin"),
+        (datetime.date(2026, 10, 21), "Feiertag"),
+        (datetime.date(2026, 10, 30), "Außerhalb"),
+    ]
+    window = EventWindow(DAY, 7, BERLIN, 0, occurrences)
+    assert window.events_between(DAY, DAY + datetime.timedelta(days=6)) == {
+        DAY: ["• 09:00: Termin"],
+        datetime.date(2026, 10, 21): ["• Ganztägig: Feiertag"],
+    }
+
+
+def test_rule_with_vendor_extension_is_expanded(mirror):
+    store(mirror, **{"weekly.ics": vcalendar(
+        "UID:a\r\nSUMMARY:Weekly\r\nDTSTART;TZID=Europe/Berlin:20261005T090000\r\nRRULE:FREQ=WEEKLY;X-APPLE-FOO=1"
+    )})
+    assert events_on(mirror) == ["• 09:00: Weekly"]
+
+
+def test_broken_rule_skips_only_that_event(mirror):
+    store(mirror, **{
+        "broken.ics": vcalendar(
+            "UID:a\r\nSUMMARY:Kaputt\r\nDTSTART;TZID=Europe/Berlin:20261005T090000\r\nRRULE:FREQ=WEEKLY;BYDAY=XX"
+        ),
+        "fine.ics": vcalendar("UID:b\r\nSUMMARY:Heil\r\nDTSTART;TZID=Europe/Berlin:20261019T100000"),
+    })
+    assert events_on(mirror) == ["• 10:00: Heil"]
+
+
+def test_truncated_dtstart_is_rejected_at_index_time():
+    with pytest.raises(ValueError):
+        index_resource(vcalendar("UID:a\r\nSUMMARY:Kaputt\r\nDTSTART:20261019T09"))
+
+
+def test_truncated_dtstart_already_in_mirror_is_skipped(mirror):
+    row = index_resource(vcalendar("UID:a\r\nSUMMARY:Kaputt\r\nDTSTART:20261019T090000"))[0]
+    row['dtstart'] = "2026-10-19T09:"
+    fine = index_resource(vcalendar("UID:b\r\nSUMMARY:Heil\r\nDTSTART;TZID=Europe/Berlin:20261019T100000"))
+    mirror._apply(ACCOUNT, CALENDAR, "Home", "token-1", {"broken.ics": [row], "fine.ics": fine}, [], full=True)
+    assert events_on(mirror) == ["• 10:00: Heil"]
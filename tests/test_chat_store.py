@@ -0,0 +1,18 @@
+import asyncio
+
+from chat_store import ChatHistoryDB
+
+
+def test_close_writes_queued_turns(tmp_path):
+    path = str(tmp_path / "bot.sqlite3")
+    db = ChatHistoryDB(path)
+    for i in range(200):
+        db.append(1, ('user', f"Frage {i}"), ('model', f"Antwort {i}"))
+    db.close()
+    assert not db._thread.is_alive()
+
+    reopened = ChatHistoryDB(path)
+    turns = asyncio.run(reopened.load(1, 100000))
+    reopened.close()
+    assert len(turns) == 400
+    assert turns[-1] == ('model', "Antwort 199")
@@ -0,0 +1,105 @@
+import datetime
+import time
+
+import pytest
+
+from leader import LeaderLease
+from subscriptions import MinuteClock
+
+UTC = datetime.timezone.utc
+
+
+def minute(hour, minute):
+    return datetime.datetime(2026, 10, 19, hour, minute, tzinfo=UTC)
+
+
+@pytest.fixture
+def db(tmp_path):
+    return str(tmp_path / "bot.sqlite3")
+
+
+def lease(db, holder, ttl=30):
+    return LeaderLease("scheduler", holder=holder, ttl=ttl, path=db)
+
+
+# LeaderLease
+
+def test_only_one_instance_holds_the_lease(db):
+    a, b = lease(db, "a"), lease(db, "b")
+    assert a.try_acquire()
+    assert not b.try_acquire()
+    # Renewing our own lease keeps it
+    assert a.try_acquire()
+    assert a.is_leader
+    assert not b.is_leader
+
+
+def test_released_lease_is_taken_over_at_once(db):
+    a, b = lease(db, "a"), lease(db, "b")
+    a.try_acquire()
+    a.release()
+    assert not a.is_leader
+    assert b.try_acquire()
+    assert not a.try_acquire()
+
+
+def test_expired_lease_is_taken_over(db):
+    a, b = lease(db, "a", ttl=0.1), lease(db, "b", ttl=0.1)
+    assert a.try_acquire()
+    assert not b.try_acquire()
+    time.sleep(0.15)
+    # Without a renewal the old leader steps back locally ...
+    assert not a.is_leader
+    # ... and the other instance may take over
+    assert b.try_acquire()
+    assert b.is_leader
+    assert not a.try_acquire()
+
+
+def test_progress_is_only_stored_by_the_holder(db):
+    a, b = lease(db, "a"), lease(db, "b")
+    assert a.progress() is None
+    a.try_acquire()
+    a.save_progress(100.0)
+    b.save_progress(200.0)
+    assert a.progress() == 100.0
+    assert b.progress() == 100.0
+
+
+# MinuteClock
+
+def test_clock_returns_each_minute_once():
+    clock = MinuteClock()
+    assert clock.advance(minute(7, 0)) == [minute(7, 0)]
+    # A second tick within the same minute has nothing to do
+    assert clock.advance(minute(7, 0).replace(second=40)) == []
+    assert clock.advance(minute(7, 1)) == [minute(7, 1)]
+
+
+def test_clock_catches_up_on_late_ticks():
+    clock = MinuteClock()
+    clock.advance(minute(7, 0))
+    assert clock.advance(minute(7, 3)) == [minute(7, 1), minute(7, 2), minute(7, 3)]
+
+
+def test_clock_catch_up_is_bounded():
+    clock = MinuteClock(max_catch_up=3)
+    clock.advance(minute(7, 0))
+    assert clock.advance(minute(8, 0)) == [minute(7, 58), minute(7, 59), minute(8, 0)]
+
+
+def test_successor_continues_where_the_leader_stopped(db):
+    a, b = lease(db, "a", ttl=0.1), lease(db, "b", ttl=0.1)
+    clock_a, clock_b = MinuteClock(), MinuteClock()
+
+    a.try_acquire()
+    clock_a.advance(minute(7, 0))
+    minutes = clock_a.advance(minute(7, 2))
+    a.save_progress(minutes[-1].timestamp())
+
+    # The leader dies; the successor starts three minutes later
+    time.sleep(0.15)
+    assert b.try_acquire()
+    clock_b.resume(datetime.datetime.fromtimestamp(b.progress(), UTC))
+    # Neither 07:02 again nor a gap before 07:05
+    assert clock_b.advance(minute(7, 5)) == [minute(7, 3), minute(7, 4), minute(7, 5)]
@@ -0,0 +1,116 @@
+import asyncio
+import datetime
+
+import pytest
+from telegram.error import RetryAfter
+
+from send_queue import PriorityRateLimiter, INTERACTIVE, BROADCAST
+
+
+def run(limiter, coro):
+    """Runs `coro` against an initialized limiter and shuts the limiter down afterwards."""
+    async def main():
+        await limiter.initialize()
+        try:
+            return await coro
+        finally:
+            await limiter.shutdown()
+    return asyncio.run(main())
+
+
+def send(limiter, sent, chat_id, priority=INTERACTIVE, endpoint="sendMessage"):
+    async def callback():
+        sent.append(chat_id)
+        return chat_id
+    return limiter.process_request(
+        callback, (), {}, endpoint, {'chat_id': chat_id}, {'priority': priority}
+    )
+
+
+def test_initialize_twice_starts_one_dispatcher():
+    limiter = PriorityRateLimiter()
+
+    async def main():
+        await limiter.initialize()
+        dispatcher = limiter._dispatcher
+        await limiter.initialize()
+        assert limiter._dispatcher is dispatcher
+        await limiter.shutdown()
+        assert dispatcher.cancelled()
+
+    asyncio.run(main())
+
+
+def test_interactive_requests_go_before_broadcasts():
+    limiter = PriorityRateLimiter(global_rate=1000)
+    sent = []
+
+    async def main():
+        # All five are queued before the dispatcher gets to run
+        await asyncio.gather(
+            send(limiter, sent, 1, BROADCAST),
+            send(limiter, sent, 2, BROADCAST),
+            send(limiter, sent, 3, INTERACTIVE),
+            send(limiter, sent, 4, BROADCAST),
+            send(limiter, sent, 5, INTERACTIVE),
+        )
+
+    run(limiter, main())
+    assert sent == [3, 5, 1, 2, 4]
+
+
+def test_busy_chat_does_not_hold_up_others():
+    limiter = PriorityRateLimiter(global_rate=1000, chat_rate=1)
+
+    async def main():
+        sent = []
+        # A private chat may burst three messages, the fourth has to wait a second
+        busy = [asyncio.ensure_future(send(limiter, sent, 1)) for _ in range(4)]
+        other = asyncio.ensure_future(send(limiter, sent, 2))
+        await asyncio.wait_for(other, 0.5)
+        for task in busy:
+            task.cancel()
+        return sent
+
+    assert run(limiter, main()) == [1, 1, 1, 2]
+
+
+def test_unthrottled_endpoints_bypass_the_queue():
+    limiter = PriorityRateLimiter(global_rate=1000)
+    sent = []
+    # Without initialize() there is no dispatcher; getMe must still go through
+    asyncio.run(send(limiter, sent, None, endpoint="getMe"))
+    assert sent == [None]
+
+
+def test_retry_after_pauses_and_retries():
+    limiter = PriorityRateLimiter(global_rate=1000)
+    calls = []
+
+    async def callback():
+        calls.append(asyncio.get_running_loop().time())
+        if len(calls) == 1:
+            raise RetryAfter(datetime.timedelta(milliseconds=200))
+        return "ok"
+
+    result = run(limiter, limiter.process_request(
+        callback, (), {}, "sendMessage", {'chat_id': 1}, None
+    ))
+    assert result == "ok"
+    assert len(calls) == 2
+    assert calls[1] - calls[0] >= 0.2
+
+
+def test_retry_after_gives_up_after_max_retries():
+    limiter = PriorityRateLimiter(global_rate=1000, max_retries=1)
+    calls = []
+
+    async def callback():
+        calls.append(1)
+        raise RetryAfter(datetime.timedelta(milliseconds=10))
+
+    with pytest.raises(RetryAfter):
+        run(limiter, limiter.process_request(
+            callback, (), {}, "sendMessage", {'chat_id': 1}, None
+        ))
+    assert len(calls) == 2
@@ -0,0 +1,162 @@
+import os
+import asyncio
+import logging
+import time
+
+import httpx
+
+from metrics import timed
+
+OPEN_METEO_URL = os.getenv('OPEN_METEO_URL', "https://api.open-meteo.com/v1/forecast")
+
+# Locations are snapped to a grid of this many degrees (0.25° ≈ 28 km),
+# so nearby users share one forecast
+WEATHER_GRID_DEGREES = float(os.getenv('WEATHER_GRID_DEGREES', 0.25))
+# Most coordinates sent in one Open-Meteo request
+MAX_LOCATIONS_PER_REQUEST = 100
+
+# Hamburg coordinates
+HAMBURG = (53.55, 9.99)
+
+
+def snap(latitude, longitude, grid=WEATHER_GRID_DEGREES):
+    """Returns the grid cell (lat, lon) a location belongs to."""
+    return (
+        round(round(latitude / grid) * grid, 4),
+        round(round(longitude / grid) * grid, 4),
+    )
+
+
+class WeatherProvider:
+    """
+    Async Open-Meteo client.
+
+    One pooled HTTP client is shared by all callers, parsed forecasts are kept
+    in a TTL cache per location and concurrent requests for the same location
+    share a single upstream fetch (single-flight). Forecasts for many
+    locations are fetched together in one multi-coordinate request.
+    """
+
+    def __init__(self, base_url=OPEN_METEO_URL, ttl=600, timeout=5.0):
+        self.base_url = base_url
+        self.ttl = ttl
+        self.timeout = httpx.Timeout(timeout, connect=3.0)
+        self._client = None
+        # (lat, lon) -> (expires_at, forecast)
+        self._cache = {}
+        # (lat, lon) -> asyncio.Task of the running batch fetch that includes it
+        self._inflight = {}
+
+    def _get_client(self):
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=10, max_keepalive_connections=5)
+            )
+        return self._client
+
+    async def get_forecast(self, latitude, longitude):
+        """Returns the parsed forecast for a location, fetching it at most once per TTL."""
+        key = (latitude, longitude)
+        forecasts = await self.get_forecasts([key])
+        if key not in forecasts:
+            raise RuntimeError(f"No forecast for {key}")
+        return forecasts[key]
+
+    async def get_forecasts(self, locations):
+        """
+        Returns {(lat, lon): forecast} for many locations. All locations that are
+        neither cached nor already being fetched go into one request. Locations
+        that could not be loaded are missing from the result.
+        """
+        now = time.monotonic()
+        forecasts = {}
+        stale = {}
+        missing = []
+        waiting = {}
+        for key in set(locations):
+            cached = self._cache.get(key)
+            if cached and cached[0] > now:
+                forecasts[key] = cached[1]
+                continue
+            if cached:
+                stale[key] = cached[1]
+            if key in self._inflight:
+                waiting[key] = self._inflight[key]
+            else:
+                missing.append(key)
+
+        for i in range(0, len(missing), MAX_LOCATIONS_PER_REQUEST):
+            batch = missing[i:i + MAX_LOCATIONS_PER_REQUEST]
+            task = asyncio.ensure_future(self._fetch(batch))
+            for key in batch:
+                self._inflight[key] = task
+                waiting[key] = task
+            task.add_done_callback(lambda _, batch=batch: self._forget(batch))
+
+        for task in set(waiting.values()):
+            try:
+                # shield: a cancelled caller must not cancel the fetch for everybody else
+                fetched = await asyncio.shield(task)
+            except Exception as e:
+                logging.error(f"Weather fetch failed: {e}")
+                continue
+            for key, waited_for in waiting.items():
+                if waited_for is task and key in fetched:
+                    forecasts[key] = fetched[key]
+
+        for key, forecast in stale.items():
+            if key not in forecasts:
+                logging.warning(f"Serving stale forecast for {key}")
+                forecasts[key] = forecast
+        return forecasts
+
+    def _forget(self, batch):
+        for key in batch:
+            self._inflight.pop(key, None)
+
+    async def _fetch(self, batch):
+        params = {
+            'latitude': ",".join(str(latitude) for latitude, _ in batch),
+            'longitude': ",".join(str(longitude) for _, longitude in batch),
+            'current': 'temperature_2m,weather_code',
+            'daily': 'weather_code,temperature_2m_max,temperature_2m_min',
+            'timezone': 'auto',
+            'forecast_days': 1,
+        }
+        async with timed("open_meteo", "forecast"):
+            response = await self._get_client().get(self.base_url, params=params)
+            response.raise_for_status()
+            data = response.json()
+        # A single location comes back as an object, several as a list in request order
+        if isinstance(data, dict):
+            data = [data]
+
+        fetched = {}
+        expires_at = time.monotonic() + self.ttl
+        for key, item in zip(batch, data):
+            forecast = {
+                'current_temp': item['current']['temperature_2m'],
+                'max_temp': item['daily']['temperature_2m_max'][0],
+                'min_temp': item['daily']['temperature_2m_min'][0],
+            }
+            self._cache[key] = (expires_at, forecast)
+            fetched[key] = forecast
+        return fetched
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+def format_weather(forecast, place="in Hamburg"):
+    """Renders a forecast as the short weather block used in messages."""
+    return (
+        f"🌦 **Wetter {place}**\n"
+        f"Aktuell: {forecast['current_temp']}°C\n"
+        f"Tageswerte: {forecast['min_temp']}°C bis {forecast['max_temp']}°C"
+    )
+
+
+weather_provider = WeatherProvider()